@@ -160,9 +160,31 @@ export default class App extends util.Target {
             odom.size = [1654, 821];
             odom.imageSrc = "2024.png";
             const robots = {};
+            // python attribute names to render property names, x_y to xY
+            const convertKey = k => {
+                let k2 = "";
+                for (let i = 0; i < k.length; i++) {
+                    let c = k[i];
+                    if (c == "_") continue;
+                    if (i-1 >= 0 && k[i-1] == "_") k2 += c.toUpperCase();
+                    else k2 += c.toLowerCase();
+                }
+                return k2;
+            };
+            const change = (id, k, v) => {
+                if (!(id in robots)) return console.error("C: Nonexistent robot with id", id);
+                if (["x", "y", "w", "h", "velocityX", "velocityY"].includes(k)) v *= 100;
+                if (["heading"].includes(k)) v *= 180/Math.PI;
+                if (k == "color") {
+                    robots[id].color = "c"+v;
+                    robots[id].colorH = "c"+v+"5";
+                    return;
+                }
+                robots[id][k] = v;
+            };
             window.api.onData((_, data) => {
                 data.forEach((cmd) => {
-                    if (cmd.length <= 0) return;
+                    if (!Array.isArray(cmd) || cmd.length <= 0) return;
                     const name = String(cmd.shift());
                     let namefs = {
                         add: () => {
@@ -175,29 +197,34 @@ export default class App extends util.Target {
                             if (cmd.length != 1) return console.error("REM: Command length", cmd.length);
                             const id = String(cmd.shift());
                             if (!(id in robots)) return console.error("REM: Nonexistent robot with id", id);
+                            odom.render.remRender(robots[id]);
+                            delete robots[id];
+                        },
+                        // before a snapshot, which may leave out robots removed in a dropped frame
+                        clear: () => {
+                            if (cmd.length != 0) return console.error("CLEAR: Command length", cmd.length);
+                            Object.keys(robots).forEach(id => {
+                                odom.render.remRender(robots[id]);
+                                delete robots[id];
+                            });
                         },
                         c: () => {
                             if (cmd.length != 3) return console.error("C: Command length", cmd.length);
                             const id = String(cmd.shift());
                             let k = String(cmd.shift());
                             let v = cmd.shift();
-                            if (!(id in robots)) return console.error("C: Nonexistent robot with id", id);
-                            let k2 = "";
-                            for (let i = 0; i < k.length; i++) {
-                                let c = k[i];
-                                if (c == "_") continue;
-                                if (i-1 >= 0 && k[i-1] == "_") k2 += c.toUpperCase();
-                                else k2 += c.toLowerCase();
-                            }
-                            k = k2;
-                            if (["x", "y", "w", "h", "velocityX", "velocityY"].includes(k)) v *= 100;
-                            if (["heading"].includes(k)) v *= 180/Math.PI;
-                            if (k == "color") {
-                                robots[id].color = "c"+v;
-                                robots[id].colorH = "c"+v+"5";
-                                return;
-                            }
-                            robots[id][k] = v;
+                            change(id, convertKey(k), v);
+                        },
+                        // many robots at once, values[j][i] is key j of robot i
+                        cs: () => {
+                            if (cmd.length != 3) return console.error("CS: Command length", cmd.length);
+                            const ids = cmd.shift();
+                            const keys = cmd.shift();
+                            const values = cmd.shift();
+                            keys.forEach((k, j) => {
+                                k = convertKey(String(k));
+                                ids.forEach((id, i) => change(String(id), k, values[j][i]));
+                            });
                         },
                     };
                     if (name in namefs) namefs[name]();
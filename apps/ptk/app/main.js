@@ -7,15 +7,23 @@
     const TEXTDECODER = new TextDecoder();
 
     // key and id for pipe setup
-    const findArg = k => process.argv.find(arg => {
-        arg = arg.split("=");
-        if (arg.length != 2) return false;
-        if (arg[0] != k) return false;
-        return true;
-    }).split("=")[1];
+    const findArg = (k, def=null) => {
+        const arg = process.argv.find(arg => {
+            arg = arg.split("=");
+            if (arg.length != 2) return false;
+            if (arg[0] != k) return false;
+            return true;
+        });
+        if (arg == null) return def;
+        return arg.split("=")[1];
+    };
 
     const KEY = findArg("key");
     const ID = findArg("id");
+    // wire format of the pipe, json or binary, see ptk/wire.py
+    const WIRE = findArg("wire", "json");
+    // optional file of the latest numeric robot state, see ptk/shared.py
+    const SHM = findArg("shm");
 
     const electron = require("electron");
     
@@ -29,7 +37,11 @@
     const queue = [];
     const queueData = data => {
         t0 = Math.max(t0, new Date().getTime());
-        if (data != "poll") queue.push(data);
+        // the keepalive "poll" rides in frames with the commands, only the commands go to the window
+        data = Array.isArray(data) ? data.filter(cmd => Array.isArray(cmd)) : [];
+        if (data.length > 0) queue.push(data);
+        // robots may have just been added, so the shared state goes out again even if it has not changed
+        sharedStale = true;
         dequeueData();
     };
     const dequeueData = () => {
@@ -57,10 +69,89 @@
     const pipePath = path.join(process.cwd(), `._${KEY}_${ID}`);
     const child = cp.spawn("mkfifo", [pipePath]);
 
+    // binary frames hold segments of json packets and of numeric changes
+    const decodeFrame = frame => {
+        const view = new DataView(frame.buffer, frame.byteOffset, frame.byteLength);
+        const data = [];
+        let i = 0;
+        while (i < frame.length) {
+            const type = view.getUint8(i);
+            i += 1;
+            if (type == 0) {
+                const l = view.getUint32(i, true);
+                i += 4;
+                data.push(...JSON.parse(TEXTDECODER.decode(frame.subarray(i, i+l))));
+                i += l;
+                continue;
+            }
+            if (type == 1) {
+                const strings = [];
+                const m = view.getUint16(i, true);
+                i += 2;
+                for (let j = 0; j < m; j++) {
+                    const l = view.getUint8(i);
+                    i += 1;
+                    strings.push(TEXTDECODER.decode(frame.subarray(i, i+l)));
+                    i += l;
+                }
+                const n = view.getUint32(i, true);
+                i += 4;
+                const ids = i, keys = i+2*n, values = i+4*n;
+                for (let j = 0; j < n; j++)
+                    data.push(["c", strings[view.getUint16(ids+2*j, true)], strings[view.getUint16(keys+2*j, true)], view.getFloat64(values+8*j, true)]);
+                i += 12*n;
+                continue;
+            }
+            if (type == 2) {
+                const n = view.getUint32(i, true);
+                const m = view.getUint8(i+4);
+                i += 5;
+                const strings = [];
+                for (let j = 0; j < n+m; j++) {
+                    const l = view.getUint8(i);
+                    i += 1;
+                    strings.push(TEXTDECODER.decode(frame.subarray(i, i+l)));
+                    i += l;
+                }
+                // copied out so every row is aligned
+                const rows = [];
+                for (let j = 0; j < m; j++) {
+                    rows.push(new Float64Array(frame.buffer.slice(frame.byteOffset+i, frame.byteOffset+i+8*n)));
+                    i += 8*n;
+                }
+                data.push(["cs", strings.slice(0, n), strings.slice(n), rows]);
+                continue;
+            }
+            throw new Error("Unknown segment type "+type);
+        }
+        return data;
+    };
+
     // process completion
     child.on("exit", () => {
         const file = fs.openSync(pipePath, "r+");
         const stream = fs.createReadStream(null, { fd: file });
+        if (WIRE == "binary") {
+            // length prefixed frames, carry over whatever is left of a partial frame
+            let pending = Buffer.alloc(0);
+            stream.on("data", data => {
+                pending = (pending.length > 0) ? Buffer.concat([pending, data]) : data;
+                while (pending.length >= 4) {
+                    const l = pending.readUInt32LE(0);
+                    if (pending.length < 4+l) break;
+                    const frame = pending.subarray(4, 4+l);
+                    pending = pending.subarray(4+l);
+                    try {
+                        data = decodeFrame(frame);
+                    } catch (e) {
+                        console.error("Bad frame", e);
+                        continue;
+                    }
+                    queueData(data);
+                }
+            });
+            return;
+        }
         // carry-over data in case we somehow get PART of a message
         let predata = "";
         stream.on("data", data => {
@@ -82,6 +173,46 @@
         });
     });
 
+    // shared state, read once a frame and sent as one column change whenever its sequence moves
+    // the sequence is odd during a write, and a read that sees it change is thrown away
+    const SHAREDKEYS = ["x", "y", "heading", "velocity_x", "velocity_y", "w", "h"];
+    let sharedFile = null, sharedSeq = null, sharedStale = true;
+    const sharedHeader = Buffer.alloc(16);
+    const readShared = () => {
+        if (SHM == null) return;
+        if (!ready) return;
+        try {
+            if (sharedFile == null) sharedFile = fs.openSync(path.join(process.cwd(), SHM), "r");
+        } catch (e) { return; }
+        for (let attempt = 0; attempt < 4; attempt++) {
+            fs.readSync(sharedFile, sharedHeader, 0, 16, 0);
+            const seq = sharedHeader.readUInt32LE(0);
+            if (seq % 2 == 1) continue;
+            if (seq == sharedSeq && !sharedStale) return;
+            const used = sharedHeader.readUInt32LE(4), size = sharedHeader.readUInt32LE(12);
+            const slots = Buffer.alloc(used*size);
+            fs.readSync(sharedFile, slots, 0, slots.length, 16);
+            fs.readSync(sharedFile, sharedHeader, 0, 4, 0);
+            if (sharedHeader.readUInt32LE(0) != seq) continue;
+            sharedSeq = seq;
+            sharedStale = false;
+            const ids = [];
+            const rows = SHAREDKEYS.map(() => []);
+            for (let i = 0; i < used; i++) {
+                const o = i*size;
+                const l = slots.readUInt8(o);
+                if (l <= 0) continue;
+                ids.push(slots.toString("utf8", o+1, o+1+l));
+                rows.forEach((row, j) => row.push(slots.readDoubleLE(o+16+8*j)));
+            }
+            if (ids.length <= 0) return;
+            queue.push([["cs", ids, SHAREDKEYS, rows]]);
+            dequeueData();
+            return;
+        }
+    };
+    setInterval(readShared, 1000/60);
+
     // disconnection detection
     const id = setInterval(() => {
         let t1 = new Date().getTime();
@@ -0,0 +1,315 @@
+import enum
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import ptk.util as util
+from ptk.odom2d import Odometry2d
+
+
+# python -m ptk.bench [robots] [frames], from the directory above ptk
+# no window is started, everything queued is thrown away after each frame
+# each layout runs in its own process, so what one allocates does not change the numbers of the next
+
+class DictRobot:
+    # the Robot from before slots, attributes in a per-instance __dict__ and dirty attributes in a set
+    Types = Odometry2d.Robot.Types
+
+    def __init__(self, odometry, *, pos=(0, 0), size=(1, 1), velocity=(0, 0), heading=0):
+        self._ID = util.random_id()
+        if not isinstance(odometry, Odometry2d):
+            raise Exception("Odometry parameter is not of class Odometry2d")
+        self._odometry = odometry
+
+        # version counts changes, dirty holds the attributes changed since they were last queued
+        self._version = 0
+        self._dirty = set()
+
+        self._type = self.__class__.Types.DEFAULT
+
+        self._x = self._y = 0
+        # self._name = ""
+        self._w = self._h = 0
+        self._velocity_x = self._velocity_y = 0
+        self._show_velocity = False
+        self._heading = 0
+
+        self._color = "b"
+
+        self.pos = pos
+        # self.name = name
+        self.size = size
+        self.heading = heading
+        self.velocity = velocity
+
+        self.odometry.add(self)
+    
+    @property
+    def ID(self):
+        return self._ID
+    @property
+    def ids(self):
+        return [self.ID]
+    @property
+    def odometry(self):
+        return self._odometry
+    @property
+    def version(self):
+        return self._version
+    @property
+    def dirty(self):
+        return len(self._dirty) > 0
+    
+    # TYPE
+    @property
+    def type(self):
+        return self._type
+    @type.setter
+    def type(self, v):
+        if not isinstance(v, self.__class__.Types):
+            v = self.__class__.Types.DEFAULT
+        self._type = v
+        self.queue_change("type")
+    
+    # POS
+    @property
+    def x(self):
+        return self._x
+    @x.setter
+    def x(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.x == v:
+            return
+        self._x = v
+        self.queue_change("x")
+    @property
+    def y(self):
+        return self._y
+    @y.setter
+    def y(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.y == v:
+            return
+        self._y = v
+        self.queue_change("y")
+    @property
+    def pos(self):
+        return self.x, self.y
+    @pos.setter
+    def pos(self, v):
+        v = v if isinstance(v, tuple) and len(v) == 2 else (0, 0)
+        self.x, self.y = v
+    
+    # NAME
+    # @property
+    # def name(self):
+    #     return self._name
+    # @name.setter
+    # def name(self, v):
+    #     v = str(v)
+    #     if self.name == v:
+    #         return
+    #     self._name = v
+    #     self.queue_change("name")
+    
+    # SIZE
+    @property
+    def w(self):
+        return self._w
+    @w.setter
+    def w(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.w == v:
+            return
+        self._w = v
+        self.queue_change("w")
+    @property
+    def h(self):
+        return self._h
+    @h.setter
+    def h(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.h == v:
+            return
+        self._h = v
+        self.queue_change("h")
+    @property
+    def size(self):
+        return self.w, self.h
+    @size.setter
+    def size(self, v):
+        v = v if isinstance(v, tuple) and len(v) == 2 else (0, 0)
+        self.w, self.h = v
+
+    # VELOCITY
+    @property
+    def velocity_x(self):
+        return self._velocity_x
+    @velocity_x.setter
+    def velocity_x(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.velocity_x == v:
+            return
+        self._velocity_x = v
+        self.queue_change("velocity_x")
+    @property
+    def velocity_y(self):
+        return self._velocity_y
+    @velocity_y.setter
+    def velocity_y(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.velocity_y == v:
+            return
+        self._velocity_y = v
+        self.queue_change("velocity_y")
+    @property
+    def velocity(self):
+        return self.velocity_x, self.velocity_y
+    @velocity.setter
+    def velocity(self, v):
+        v = v if isinstance(v, tuple) and len(v) == 2 else (0, 0)
+        self.velocity_x, self.velocity_y = v
+    @property
+    def show_velocity(self):
+        return self._show_velocity
+    @show_velocity.setter
+    def show_velocity(self, v):
+        v = not not v
+        if self.show_velocity == v:
+            return
+        self._show_velocity = v
+        self.queue_change("show_velocity")
+
+    # HEADING
+    @property
+    def heading(self):
+        return self._heading
+    @heading.setter
+    def heading(self, v):
+        v = v if isinstance(v, int) or isinstance(v, float) else 0
+        if self.heading == v:
+            return
+        self._heading = v
+        self.queue_change("heading")
+    
+    # COLOR
+    @property
+    def color(self):
+        return self._color
+    @color.setter
+    def color(self, v):
+        v = str(v)
+        if self.color == v:
+            return
+        self._color = v
+        self.queue_change("color")
+
+    def queue_change(self, k):
+        self._dirty.add(str(k))
+        self._version += 1
+        return self.odometry.mark_dirty(self)
+    def flush_changes(self):
+        for k in self._dirty:
+            v = getattr(self, k)
+            if isinstance(v, enum.Enum):
+                v = v.value
+            self.odometry.queue_change(self.ID, k, v)
+        self._dirty.clear()
+    def queue_change_all(self):
+        [self.queue_change(k) for k in [
+            "type",
+            "x", "y",
+            # "name",
+            "w", "h",
+            "velocity_x", "velocity_y",
+            "show_velocity",
+            "heading",
+            "color",
+        ]]
+
+
+class DictOdometry(Odometry2d):
+    # add() only takes the odometry's own Robot class
+    Robot = DictRobot
+
+
+def odometry(cls=Odometry2d):
+    odometry = cls(start=False)
+    odometry.autoflush = False
+    return odometry
+
+def discard(odometry):
+    odometry.flush_changes()
+    odometry._queue.clear()
+    odometry._queue_keys.clear()
+
+def memory(cls, make, n):
+    # bytes per robot, including its ID and what the odometry keeps for it
+    # a first batch warms up the caches and free lists, so they are not counted against the robots
+    o = odometry(cls)
+    make(o, n)
+    discard(o)
+    del o
+    o = odometry(cls)
+    discard(o)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    make(o, n)
+    discard(o)
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used / n
+
+def setters(cls, n, frames):
+    # seconds per frame to move every robot and flush
+    o = odometry(cls)
+    robots = [o.Robot(o) for _ in range(n)]
+    discard(o)
+    t = time.perf_counter()
+    for f in range(frames):
+        for i, robot in enumerate(robots):
+            robot.pos = (f + i * 0.01, f * 0.5)
+            robot.heading = f * 0.1
+        discard(o)
+    return (time.perf_counter() - t) / frames
+
+def array_setters(n, frames):
+    import numpy as np
+    o = odometry()
+    robots = Odometry2d.RobotArray(o, n)
+    discard(o)
+    xy = np.stack([np.arange(n) * 0.01, np.zeros(n)], axis=-1)
+    t = time.perf_counter()
+    for f in range(frames):
+        robots.set_poses(None, xy + [f, f * 0.5], np.full(n, f * 0.1))
+        discard(o)
+    return (time.perf_counter() - t) / frames
+
+def layout(name, n, frames):
+    if name == "RobotArray":
+        try:
+            make = lambda o, n: Odometry2d.RobotArray(o, n)
+            return f"{memory(Odometry2d, make, n):8.0f} B/robot {array_setters(n, frames)*1e3:8.2f} ms/frame"
+        except Exception as e:
+            return f"skipped, {e}"
+    cls = DictOdometry if name == "Robot with __dict__" else Odometry2d
+    make = lambda o, n: [o.Robot(o) for _ in range(n)]
+    return f"{memory(cls, make, n):8.0f} B/robot {setters(cls, n, frames)*1e3:8.2f} ms/frame"
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--layout":
+        name, n, frames = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        print(f"{name:>20}: {layout(name, n, frames)}", flush=True)
+        return
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    print(f"{n} robots, {frames} frames", flush=True)
+    for name in ["Robot", "Robot with __dict__", "RobotArray"]:
+        subprocess.run([sys.executable, "-m", "ptk.bench", "--layout", name, str(n), str(frames)],
+                       cwd=os.path.split(os.path.split(os.path.abspath(__file__))[0])[0])
+
+if __name__ == "__main__":
+    main()
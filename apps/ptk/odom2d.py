@@ -1,20 +1,59 @@
-import time
-
 import enum
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 import ptk.util as util
+import ptk.shared
 
 
 class Odometry2d(util.Process):
-    def __init__(self, *, wordy=False):
-        super().__init__(name="Odometry2d", key="ptk_odom2d", wordy=wordy)
+    def __init__(self, *, wordy=False, wire="json", nonblocking=False, buffer_size=1<<20, overflow="drop-oldest",
+                 rate=60, adaptive=False, min_rate=5, start=True, shared_slots=0):
+        # robots by ID, and the ones with changes not yet queued
+        self._robots = {}
+        self._dirty = {}
+
+        # numeric robot state goes through a shared file instead of the pipe when there are slots for it
+        self._shared_slots = int(shared_slots)
+        self._shared = None
+        self._shared_recorded = None
 
-        self._robots = []
-        self._robots_periodic = time.time()
+        super().__init__(name="Odometry2d", key="ptk_odom2d", wordy=wordy, wire=wire,
+                         nonblocking=nonblocking, buffer_size=buffer_size, overflow=overflow,
+                         rate=rate, adaptive=adaptive, min_rate=min_rate, start=start)
+
+    def __del__(self):
+        super().__del__()
+        if self._shared is not None:
+            self._shared.close()
+
+    @property
+    def shared(self):
+        return self._shared
+    def start_process(self):
+        # the shared file has to exist before the window looks for it
+        if self._shared_slots > 0 and self._shared is None:
+            self._shared = ptk.shared.SharedState(
+                os.path.join(os.path.split(os.path.abspath(__file__))[0], f"._{self.key}_{self.ID}.shm"),
+                self._shared_slots,
+            )
+            for robot in self._robots.values():
+                if isinstance(robot, self.__class__.Robot):
+                    self._shared.assign(robot.ID)
+        return super().start_process()
+    def process_args(self):
+        args = super().process_args()
+        if self._shared is not None:
+            args.append(f"shm={os.path.split(self._shared.path)[1]}")
+        return args
     
     @property
     def robots(self):
-        return [*self._robots]
+        return [*self._robots.values()]
     @robots.setter
     def robots(self, v):
         v = v if isinstance(v, list) else []
@@ -25,45 +64,81 @@ class Odometry2d(util.Process):
         self.remove(*robots)
         return robots
     def has(self, robot):
-        return robot in self._robots
+        return self._robots.get(robot.ID) is robot
     def add(self, *robots):
         for robot in robots:
-            if not isinstance(robot, self.__class__.Robot):
+            if not isinstance(robot, (self.__class__.Robot, self.__class__.RobotArray)):
                 continue
             if robot.odometry is not self:
                 continue
             if self.has(robot):
                 continue
-            self._robots.append(robot)
-            self.queue_command("add", robot.ID)
+            self._robots[robot.ID] = robot
+            if self._shared is not None and isinstance(robot, self.__class__.Robot):
+                self._shared.assign(robot.ID)
+            for id_ in robot.ids:
+                self.queue_command("add", id_)
             robot.queue_change_all()
+            self.mark_dirty(robot)
     def remove(self, *robots):
         for robot in robots:
-            if not isinstance(robot, self.__class__.Robot):
+            if not isinstance(robot, (self.__class__.Robot, self.__class__.RobotArray)):
                 continue
             if robot.odometry is not self:
                 continue
             if not self.has(robot):
                 continue
-            self._robots.remove(robot)
-            self.queue_command("rem", robot.ID)
+            del self._robots[robot.ID]
+            self._dirty.pop(robot.ID, None)
+            if self._shared is not None:
+                self._shared.release(robot.ID)
+            for id_ in robot.ids:
+                self.queue_command("rem", id_)
     
     def queue_command(self, name, *a):
         return self.queue([name, *a])
     def queue_change(self, id_, k, v):
-        return self.queue_command("c", id_, k, v)
+        if self._shared is not None and self._shared.write(id_, k, v):
+            return True
+        return self.queue(["c", id_, k, v], key=(id_, k))
     def queue_change_all(self):
-        for robot in self._robots:
+        for robot in self._robots.values():
+            robot.queue_change_all()
+    def mark_dirty(self, robot):
+        if not self.has(robot):
+            return False
+        self._dirty[robot.ID] = robot
+        return True
+    def flush_changes(self):
+        dirty = [*self._dirty.values()]
+        self._dirty.clear()
+        if self._shared is not None:
+            self._shared.begin()
+        for robot in dirty:
+            robot.flush_changes()
+        if self._shared is not None:
+            self._shared.end()
+        return len(dirty)
+
+    def resync(self):
+        # the reader may be a new window that has never seen these robots, or may have missed frames, so it gets every robot from scratch
+        # a dropped frame may have held an add or rem, so the window first drops whatever robots it has
+        # anything still queued is covered by the snapshot
+        self.log("snapshot")
+        self._queue[:] = [["clear"], *(["add", id_] for robot in self._robots.values() for id_ in robot.ids)]
+        self._queue_keys.clear()
+        for robot in self._robots.values():
             robot.queue_change_all()
         
-    def update(self):
-        super().update()
-        t = time.time()
-        if t - self._robots_periodic < 1:
-            return
-        self.log("flash")
-        self._robots_periodic = t
-        self.queue_change_all()
+    def queue_pending(self):
+        self.flush_changes()
+    def flush(self):
+        result = super().flush()
+        if self.recorder is not None and self._shared is not None and self.has_active_pipe and self._shared.seq != self._shared_recorded:
+            # values in the shared file never pass through the queue, so the recording gets them as a snapshot after the batch that added the robots
+            self._shared_recorded = self._shared.seq
+            self.recorder.write([self._shared.snapshot()])
+        return result
     
     class Robot:
         class Types(enum.Enum):
@@ -77,13 +152,43 @@ class Odometry2d(util.Process):
             P_2023_CUBE = "§2023-cube"
             P_2024_NOTE = "§2024-note"
 
+        # every attribute sent to the window, a robot's dirty attributes are a bitmask over these
+        KEYS = (
+            "type",
+            "x", "y",
+            # "name",
+            "w", "h",
+            "velocity_x", "velocity_y",
+            "show_velocity",
+            "heading",
+            "color",
+        )
+        KEY_BITS = {k: 1 << i for i, k in enumerate(KEYS)}
+
+        # no per-instance __dict__, thousands of these get made and dropped when replaying matches
+        __slots__ = (
+            "_ID", "_odometry",
+            "_version", "_dirty",
+            "_type",
+            "_x", "_y",
+            "_w", "_h",
+            "_velocity_x", "_velocity_y",
+            "_show_velocity",
+            "_heading",
+            "_color",
+        )
+
         def __init__(self, odometry, *, pos=(0, 0), size=(1, 1), velocity=(0, 0), heading=0):
             self._ID = util.random_id()
             if not isinstance(odometry, Odometry2d):
                 raise Exception("Odometry parameter is not of class Odometry2d")
             self._odometry = odometry
 
-            self._type = self.__class__.Types.DEFAULT
+            # version counts changes, dirty holds the attributes changed since they were last queued
+            self._version = 0
+            self._dirty = 0
+
+            self._type = Odometry2d.Robot.Types.DEFAULT
 
             self._x = self._y = 0
             # self._name = ""
@@ -106,8 +211,17 @@ class Odometry2d(util.Process):
         def ID(self):
             return self._ID
         @property
+        def ids(self):
+            return [self.ID]
+        @property
         def odometry(self):
             return self._odometry
+        @property
+        def version(self):
+            return self._version
+        @property
+        def dirty(self):
+            return self._dirty != 0
         
         # TYPE
         @property
@@ -115,8 +229,8 @@ class Odometry2d(util.Process):
             return self._type
         @type.setter
         def type(self, v):
-            if not isinstance(v, self.__class__.Types):
-                v = self.__class__.Types.DEFAULT
+            if not isinstance(v, Odometry2d.Robot.Types):
+                v = Odometry2d.Robot.Types.DEFAULT
             self._type = v
             self.queue_change("type")
         
@@ -126,8 +240,8 @@ class Odometry2d(util.Process):
             return self._x
         @x.setter
         def x(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.x == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._x == v:
                 return
             self._x = v
             self.queue_change("x")
@@ -136,8 +250,8 @@ class Odometry2d(util.Process):
             return self._y
         @y.setter
         def y(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.y == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._y == v:
                 return
             self._y = v
             self.queue_change("y")
@@ -167,8 +281,8 @@ class Odometry2d(util.Process):
             return self._w
         @w.setter
         def w(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.w == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._w == v:
                 return
             self._w = v
             self.queue_change("w")
@@ -177,8 +291,8 @@ class Odometry2d(util.Process):
             return self._h
         @h.setter
         def h(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.h == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._h == v:
                 return
             self._h = v
             self.queue_change("h")
@@ -196,8 +310,8 @@ class Odometry2d(util.Process):
             return self._velocity_x
         @velocity_x.setter
         def velocity_x(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.velocity_x == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._velocity_x == v:
                 return
             self._velocity_x = v
             self.queue_change("velocity_x")
@@ -206,8 +320,8 @@ class Odometry2d(util.Process):
             return self._velocity_y
         @velocity_y.setter
         def velocity_y(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.velocity_y == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._velocity_y == v:
                 return
             self._velocity_y = v
             self.queue_change("velocity_y")
@@ -224,7 +338,7 @@ class Odometry2d(util.Process):
         @show_velocity.setter
         def show_velocity(self, v):
             v = not not v
-            if self.show_velocity == v:
+            if self._show_velocity == v:
                 return
             self._show_velocity = v
             self.queue_change("show_velocity")
@@ -235,12 +349,173 @@ class Odometry2d(util.Process):
             return self._heading
         @heading.setter
         def heading(self, v):
-            v = v if isinstance(v, int) or isinstance(v, float) else 0
-            if self.heading == v:
+            v = v if isinstance(v, (int, float)) else 0
+            if self._heading == v:
                 return
             self._heading = v
             self.queue_change("heading")
         
+        # COLOR
+        @property
+        def color(self):
+            return self._color
+        @color.setter
+        def color(self, v):
+            v = str(v)
+            if self._color == v:
+                return
+            self._color = v
+            self.queue_change("color")
+
+        def queue_change(self, k):
+            dirty = self._dirty
+            self._dirty = dirty | Odometry2d.Robot.KEY_BITS[str(k)]
+            self._version += 1
+            # already marked with the odometry since the last flush
+            if dirty:
+                return True
+            return self._odometry.mark_dirty(self)
+        def flush_changes(self):
+            dirty = self._dirty
+            self._dirty = 0
+            for k in Odometry2d.Robot.KEYS:
+                if not dirty & Odometry2d.Robot.KEY_BITS[k]:
+                    continue
+                v = getattr(self, k)
+                if isinstance(v, enum.Enum):
+                    v = v.value
+                self._odometry.queue_change(self._ID, k, v)
+        def queue_change_all(self):
+            [self.queue_change(k) for k in Odometry2d.Robot.KEYS]
+
+    class RobotArray:
+        # many robots stored as columns of numpy arrays, meant for particles and game pieces
+        # changed entries go out as one "cs" command per flush instead of one "c" command per robot and attribute
+        KEYS = ("x", "y", "heading", "velocity_x", "velocity_y", "w", "h")
+
+        def __init__(self, odometry, n, *, size=(1, 1)):
+            if np is None:
+                raise Exception("RobotArray requires numpy")
+            self._ID = util.random_id()
+            if not isinstance(odometry, Odometry2d):
+                raise Exception("Odometry parameter is not of class Odometry2d")
+            self._odometry = odometry
+
+            self._ids = [util.random_id() for _ in range(int(n))]
+
+            # one row per key, one column per robot, and which entries changed since the last flush
+            self._values = np.zeros((len(self.KEYS), len(self._ids)))
+            self._changed = np.zeros(self._values.shape, dtype=bool)
+
+            # attributes shared by every robot in the array
+            self._version = 0
+            self._dirty = set()
+
+            self._type = Odometry2d.Robot.Types.DEFAULT
+            self._show_velocity = False
+            self._color = "b"
+
+            self.set_sizes(None, size)
+
+            self.odometry.add(self)
+
+        def __len__(self):
+            return len(self._ids)
+
+        @property
+        def ID(self):
+            return self._ID
+        @property
+        def ids(self):
+            return [*self._ids]
+        @property
+        def odometry(self):
+            return self._odometry
+        @property
+        def version(self):
+            return self._version
+        @property
+        def dirty(self):
+            return len(self._dirty) > 0 or bool(self._changed.any())
+
+        def get(self, k):
+            v = self._values[self.KEYS.index(k)].view()
+            v.flags.writeable = False
+            return v
+        @property
+        def x(self):
+            return self.get("x")
+        @property
+        def y(self):
+            return self.get("y")
+        @property
+        def heading(self):
+            return self.get("heading")
+        @property
+        def velocity_x(self):
+            return self.get("velocity_x")
+        @property
+        def velocity_y(self):
+            return self.get("velocity_y")
+        @property
+        def w(self):
+            return self.get("w")
+        @property
+        def h(self):
+            return self.get("h")
+
+        def set(self, k, idx, v):
+            # idx is anything that indexes a numpy array, None for every robot
+            i = self.KEYS.index(k)
+            idx = slice(None) if idx is None else idx
+            row = self._values[i]
+            v = np.broadcast_to(np.asarray(v, dtype=float), row[idx].shape)
+            changed = row[idx] != v
+            if not changed.any():
+                return False
+            row[idx] = v
+            self._changed[i, idx] |= changed
+            self._version += 1
+            self.odometry.mark_dirty(self)
+            return True
+        def set_poses(self, idx, xy, heading=None):
+            xy = np.asarray(xy, dtype=float)
+            self.set("x", idx, xy[..., 0])
+            self.set("y", idx, xy[..., 1])
+            if heading is not None:
+                self.set("heading", idx, heading)
+        def set_velocities(self, idx, v):
+            v = np.asarray(v, dtype=float)
+            self.set("velocity_x", idx, v[..., 0])
+            self.set("velocity_y", idx, v[..., 1])
+        def set_sizes(self, idx, wh):
+            wh = np.asarray(wh, dtype=float)
+            self.set("w", idx, wh[..., 0])
+            self.set("h", idx, wh[..., 1])
+
+        # TYPE
+        @property
+        def type(self):
+            return self._type
+        @type.setter
+        def type(self, v):
+            if not isinstance(v, Odometry2d.Robot.Types):
+                v = Odometry2d.Robot.Types.DEFAULT
+            self._type = v
+            self.queue_change("type")
+
+        # SHOW VELOCITY
+        @property
+        def show_velocity(self):
+            return self._show_velocity
+        @show_velocity.setter
+        def show_velocity(self, v):
+            v = not not v
+            if self.show_velocity == v:
+                return
+            self._show_velocity = v
+            self.queue_change("show_velocity")
+
         # COLOR
         @property
         def color(self):
@@ -254,19 +529,28 @@ class Odometry2d(util.Process):
             self.queue_change("color")
 
         def queue_change(self, k):
-            k = str(k)
-            v = getattr(self, k)
-            if isinstance(v, enum.Enum):
-                v = v.value
-            return self.odometry.queue_change(self.ID, k, v)
+            self._dirty.add(str(k))
+            self._version += 1
+            return self.odometry.mark_dirty(self)
+        def flush_changes(self):
+            robots = self._changed.any(axis=0)
+            if robots.any():
+                keys = self._changed.any(axis=1)
+                self.odometry.queue_command(
+                    "cs",
+                    [self._ids[i] for i in np.flatnonzero(robots)],
+                    [self.KEYS[i] for i in np.flatnonzero(keys)],
+                    self._values[np.ix_(keys, robots)],
+                )
+                self._changed[:] = False
+            for k in self._dirty:
+                v = getattr(self, k)
+                if isinstance(v, enum.Enum):
+                    v = v.value
+                for id_ in self._ids:
+                    self.odometry.queue_change(id_, k, v)
+            self._dirty.clear()
         def queue_change_all(self):
-            [self.queue_change(k) for k in [
-                "type",
-                "x", "y",
-                # "name",
-                "w", "h",
-                "velocity_x", "velocity_y",
-                "show_velocity",
-                "heading",
-                "color",
-            ]]
+            self._changed[:] = True
+            for k in ["type", "show_velocity", "color"]:
+                self.queue_change(k)
@@ -0,0 +1,111 @@
+import gzip
+import json
+import struct
+import time
+import zlib
+
+import ptk.wire
+
+
+# a log is one gzip stream holding a header, then one record per batch sent, all little endian
+# header: 8 bytes of magic, f64 start time in seconds since the epoch
+# record: f64 seconds since the start, u32 length, then the batch as a utf-8 json list of packets
+# batches sent within merge_interval of the first one share a record, a process without a rate sends one per packet
+MAGIC = b"ptklog\x00\x01"
+HEADER = struct.Struct("<8sd")
+RECORD = struct.Struct("<dI")
+
+
+class Recorder:
+    def __init__(self, path, *, merge_interval=0.005, sync_interval=1):
+        self._path = str(path)
+        self._start = time.time()
+
+        self._merge_interval = merge_interval
+        self._sync_interval = sync_interval
+        self._synced = self._start
+
+        # packets already encoded, waiting for the rest of their record
+        self._pending = []
+        self._pending_t = None
+
+        self._records = 0
+
+        self._file = gzip.open(self._path, "wb")
+        self._file.write(HEADER.pack(MAGIC, self._start))
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def path(self):
+        return self._path
+    @property
+    def start(self):
+        return self._start
+    @property
+    def records(self):
+        return self._records
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write(self, batch, t=None):
+        if self._file is None:
+            return False
+        # keepalives mean nothing on replay
+        batch = [data for data in batch if data != "poll"]
+        if len(batch) <= 0:
+            return False
+        t = time.time() if t is None else t
+        if self._pending_t is not None and t - self._pending_t >= self._merge_interval:
+            self.write_pending()
+        if self._pending_t is None:
+            self._pending_t = t
+        # encoded now, later changes to arrays in the batch do not reach the log
+        self._pending.append(json.dumps(batch, default=ptk.wire.to_json)[1:-1])
+        if t - self._synced >= self._sync_interval:
+            self.write_pending()
+            # a sync flush puts everything so far on disk as whole compressed blocks, so a log cut off by a crash reads up to here
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self._synced = t
+        return True
+    def write_pending(self):
+        if self._pending_t is None:
+            return False
+        data = ("[" + ",".join(self._pending) + "]").encode("utf-8")
+        self._file.write(RECORD.pack(self._pending_t - self._start, len(data)))
+        self._file.write(data)
+        self._records += 1
+        self._pending.clear()
+        self._pending_t = None
+        return True
+
+    def close(self):
+        if self._file is None:
+            return False
+        self.write_pending()
+        self._file.close()
+        self._file = None
+        return True
+
+
+def read(path):
+    # yields (seconds since the start of the log, batch) one record at a time, so memory does not grow with the log
+    # a log that was cut off, or is still being written, ends quietly at its last whole record
+    with gzip.open(str(path), "rb") as file:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+            raise Exception(f"Not a ptk log {path}")
+        while True:
+            try:
+                head = file.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                t, n = RECORD.unpack(head)
+                data = file.read(n)
+            except (EOFError, zlib.error, gzip.BadGzipFile):
+                return
+            if len(data) < n:
+                return
+            yield t, json.loads(data)
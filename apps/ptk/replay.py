@@ -0,0 +1,141 @@
+import sys
+import time
+
+import ptk.record
+from ptk.odom2d import Odometry2d
+
+
+# python -m ptk.replay <log> [speed] [start], from the directory above ptk
+# speed is a multiple of real time, inf sends as fast as the window takes it, start is in seconds into the log
+
+class State:
+    # what a window shows after every batch so far, the attributes of each robot by id
+    def __init__(self):
+        self._robots = {}
+
+    @property
+    def ids(self):
+        return [*self._robots]
+
+    def apply(self, batch):
+        for data in batch:
+            if not isinstance(data, list) or len(data) <= 0:
+                continue
+            if data[0] == "clear" and len(data) == 1:
+                self._robots.clear()
+            elif data[0] == "add" and len(data) == 2:
+                self._robots.setdefault(data[1], {})
+            elif data[0] == "rem" and len(data) == 2:
+                self._robots.pop(data[1], None)
+            elif data[0] == "c" and len(data) == 4:
+                if data[1] in self._robots:
+                    self._robots[data[1]][data[2]] = data[3]
+            elif data[0] == "cs" and len(data) == 4:
+                for k, row in zip(data[2], data[3]):
+                    for id_, v in zip(data[1], row):
+                        if id_ in self._robots:
+                            self._robots[id_][k] = v
+
+    def packets(self):
+        packets = [["clear"]]
+        for id_, values in self._robots.items():
+            packets.append(["add", id_])
+            packets.extend(["c", id_, k, v] for k, v in values.items())
+        return packets
+
+
+class Player(Odometry2d):
+    def __init__(self, path, *, speed=1, wordy=False, wire="json", start=True):
+        self._path = str(path)
+        self._speed = 1
+        self.speed = speed
+
+        self._state = State()
+
+        super().__init__(wordy=wordy, wire=wire, start=start)
+
+        self.autoflush = False
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def speed(self):
+        return self._speed
+    @speed.setter
+    def speed(self, v):
+        v = v if (isinstance(v, int) or isinstance(v, float)) and v > 0 else 1
+        self._speed = v
+
+    @property
+    def state(self):
+        return self._state
+
+    def resync(self):
+        # a new window gets the state of the log so far instead of this odometry's own robots
+        self.log("snapshot")
+        self._queue[:] = self._state.packets()
+        self._queue_keys.clear()
+
+    def queue_packet(self, data):
+        # repeated changes to the same attribute merge when playback runs faster than the window is flushed
+        if isinstance(data, list) and len(data) == 4 and data[0] == "c":
+            return self.queue(data, key=(data[1], data[2]))
+        return self.queue(data)
+
+    def play(self, start=0, end=None):
+        # clears the window, then streams the log into it, yielding the log time of each batch once it is due
+        # batches before start are only folded into the state, which the window gets in one go when playback reaches start
+        # only one batch and the state are held at a time, however long the log
+        for id_ in self._state.ids:
+            self.queue_command("rem", id_)
+        self._state = State()
+
+        clock = None
+        for t, batch in ptk.record.read(self.path):
+            if end is not None and t > end:
+                break
+            self._state.apply(batch)
+            if t < start:
+                continue
+            if clock is None:
+                clock = (time.time(), t)
+                packets = self._state.packets()
+            else:
+                packets = batch
+            # frames keep going out while waiting, batches that are behind or nearly due pile into the queue for the next one
+            wait = clock[0] + (t - clock[1]) / self.speed - time.time()
+            while wait > 0.002:
+                time.sleep(min(wait, 1 / (self.frame_rate or 60)))
+                self.update()
+                wait = clock[0] + (t - clock[1]) / self.speed - time.time()
+            # without a pipe the state is enough, the window gets it on resync when it opens
+            if self.has_active_pipe:
+                for data in packets:
+                    self.queue_packet(data)
+            self.update()
+            yield t
+        self.flush()
+
+
+def main():
+    path = sys.argv[1]
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    start = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    player = Player(path, speed=speed)
+    t = start
+    for t in player.play(start):
+        pass
+    print(f"replayed {path} to {t:.2f} s")
+    # keeps the window up on the last frame until interrupted
+    try:
+        while True:
+            player.update()
+            time.sleep(0.25)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
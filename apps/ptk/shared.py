@@ -0,0 +1,117 @@
+import mmap
+import os
+import struct
+
+
+# a file both sides map, holding the latest numeric state of each robot in a fixed slot
+# header: u32 sequence, u32 slots in use, u32 slot count, u32 slot size, all little endian
+# slot: u8 id length, 15 bytes of id, then one f64 per key, an id length of 0 marks a free slot
+# the sequence is odd while a write is in progress, readers retry when it is odd or changed while they read
+KEYS = ("x", "y", "heading", "velocity_x", "velocity_y", "w", "h")
+HEADER = struct.Struct("<IIII")
+ID = struct.Struct("<B15s")
+VALUE = struct.Struct("<d")
+SLOT_SIZE = ID.size + VALUE.size * len(KEYS)
+KEY_OFFSETS = {k: ID.size + VALUE.size * i for i, k in enumerate(KEYS)}
+
+
+class SharedState:
+    def __init__(self, path, slots):
+        self._path = str(path)
+        self._slots = int(slots)
+
+        self._seq = 0
+        self._writing = 0
+        self._used = 0
+        self._ids = {}
+        self._free = []
+
+        with open(self._path, "w+b") as file:
+            file.truncate(HEADER.size + SLOT_SIZE * self._slots)
+            self._map = mmap.mmap(file.fileno(), HEADER.size + SLOT_SIZE * self._slots)
+        self.write_header()
+
+    @property
+    def path(self):
+        return self._path
+    @property
+    def slots(self):
+        return self._slots
+    @property
+    def seq(self):
+        return self._seq
+
+    def write_header(self):
+        HEADER.pack_into(self._map, 0, self._seq, self._used, self._slots, SLOT_SIZE)
+
+    def begin(self):
+        # writes can nest, the sequence only changes at the outermost begin and end
+        self._writing += 1
+        if self._writing > 1:
+            return
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        self.write_header()
+    def end(self):
+        self._writing -= 1
+        if self._writing > 0:
+            return
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        self.write_header()
+
+    def has(self, id_):
+        return id_ in self._ids
+    def assign(self, id_):
+        # gives id_ a slot, False when every slot is taken or the id does not fit
+        if id_ in self._ids:
+            return True
+        data = str(id_).encode("utf-8")
+        if len(data) > 15:
+            return False
+        if len(self._free) > 0:
+            slot = self._free.pop()
+        elif self._used < self._slots:
+            slot = self._used
+            self._used += 1
+        else:
+            return False
+        self.begin()
+        offset = HEADER.size + SLOT_SIZE * slot
+        self._map[offset:offset+SLOT_SIZE] = bytes(SLOT_SIZE)
+        ID.pack_into(self._map, offset, len(data), data)
+        self._ids[id_] = offset
+        self.end()
+        return True
+    def release(self, id_):
+        offset = self._ids.pop(id_, None)
+        if offset is None:
+            return False
+        self.begin()
+        self._map[offset] = 0
+        self._free.append((offset - HEADER.size) // SLOT_SIZE)
+        self.end()
+        return True
+    def write(self, id_, k, v):
+        # False when the value has to go another way
+        offset = self._ids.get(id_)
+        if offset is None or k not in KEY_OFFSETS:
+            return False
+        self.begin()
+        VALUE.pack_into(self._map, offset + KEY_OFFSETS[k], v)
+        self.end()
+        return True
+
+    def snapshot(self):
+        # every assigned slot as the "cs" command the window makes of it
+        offsets = [*self._ids.values()]
+        rows = [[VALUE.unpack_from(self._map, offset + KEY_OFFSETS[k])[0] for offset in offsets] for k in KEYS]
+        return ["cs", [*self._ids], [*KEYS], rows]
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
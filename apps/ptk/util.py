@@ -1,10 +1,17 @@
 import math
 import random
 import time
+import asyncio
 
 import os
 import subprocess
-import json
+import collections
+
+import ptk.wire
+import ptk.record
+
+
+OVERFLOWS = ("drop-oldest", "coalesce")
 
 
 CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
@@ -13,12 +20,23 @@ def random_id(l=10):
 
 
 class Process:
-    def __init__(self, *, name, key, wordy=False):
+    def __init__(self, *, name, key, wordy=False, wire="json", nonblocking=False, buffer_size=1<<20, overflow="drop-oldest",
+                 rate=60, adaptive=False, min_rate=5, start=True):
         self._ID = random_id()
 
         self._name = str(name)
         self._key = str(key)
 
+        if wire not in ptk.wire.FORMATS:
+            raise Exception(f"Unknown wire format {wire}")
+        self._wire = wire
+
+        if overflow not in OVERFLOWS:
+            raise Exception(f"Unknown overflow policy {overflow}")
+        self._nonblocking = not not nonblocking
+        self._buffer_size = int(buffer_size)
+        self._overflow = overflow
+
         self._wordy = wordy
 
         self._process = None
@@ -29,6 +47,37 @@ class Process:
         self._pipe_poll_periodic = time.time()
 
         self._queue = []
+        self._queue_keys = {}
+        self._queue_t = time.time()
+        self._autoflush = True
+        self._recorder = None
+
+        # everything queued within a frame goes out in one write, the adaptive rate drops when the pipe cannot keep up
+        self._rate = 60
+        self._min_rate = 5
+        self._frame_rate = 60
+        self.rate = rate
+        self.min_rate = min_rate
+        self._adaptive = not not adaptive
+        self._flush_periodic = 0
+
+        # stats of the recent frames, and what the adaptive rate measures against
+        self._flushes = 0
+        self._flush_stats = collections.deque(maxlen=120)
+        self._frame_t = time.time()
+        self._frame_written = 0
+        self._frame_bytes = 0
+
+        # encoded messages waiting for room in the pipe, the first may be partly written
+        self._frames = collections.deque()
+        self._frame_offset = 0
+        self._bytes_buffered = 0
+        self._bytes_written = 0
+        self._bytes_dropped = 0
+        self._resync_pending = False
+
+        if not start:
+            return
 
         self.start_process()
 
@@ -49,6 +98,78 @@ class Process:
     def key(self):
         return self._key
 
+    @property
+    def wire(self):
+        return self._wire
+
+    @property
+    def nonblocking(self):
+        return self._nonblocking
+    @property
+    def buffer_size(self):
+        return self._buffer_size
+    @property
+    def overflow(self):
+        return self._overflow
+    @property
+    def bytes_buffered(self):
+        return self._bytes_buffered
+    @property
+    def bytes_written(self):
+        return self._bytes_written
+    @property
+    def bytes_dropped(self):
+        return self._bytes_dropped
+
+    @property
+    def rate(self):
+        return self._rate
+    @rate.setter
+    def rate(self, v):
+        v = v if v is None or ((isinstance(v, int) or isinstance(v, float)) and v > 0) else 60
+        self._rate = v
+        self._frame_rate = v
+    @property
+    def min_rate(self):
+        return self._min_rate
+    @min_rate.setter
+    def min_rate(self, v):
+        v = v if (isinstance(v, int) or isinstance(v, float)) and v > 0 else 5
+        self._min_rate = v
+    @property
+    def adaptive(self):
+        return self._adaptive
+    @adaptive.setter
+    def adaptive(self, v):
+        self._adaptive = not not v
+        if not self._adaptive:
+            self._frame_rate = self._rate
+    @property
+    def frame_rate(self):
+        return self._frame_rate
+    @property
+    def flushes(self):
+        return self._flushes
+    @property
+    def flush_stats(self):
+        return self._flush_stats
+
+    @property
+    def autoflush(self):
+        return self._autoflush
+    @autoflush.setter
+    def autoflush(self, v):
+        self._autoflush = not not v
+
+    @property
+    def recorder(self):
+        return self._recorder
+    @recorder.setter
+    def recorder(self, v):
+        if v is not None and not isinstance(v, ptk.record.Recorder):
+            raise Exception("Recorder parameter is not of class Recorder")
+        self._recorder = v
+
     @property
     def wordy(self):
         return self._wordy
@@ -71,7 +192,7 @@ class Process:
         try:
             print(os.path.split(os.path.abspath(__file__))[0])
             self._process = subprocess.Popen(
-                ["npm", "start", f"key={self.key}", f"id={self.ID}"],
+                ["npm", "start", *self.process_args()],
                 cwd=os.path.split(os.path.abspath(__file__))[0],
             )
             self.log("started process")
@@ -79,6 +200,9 @@ class Process:
             self.log("starting process", "ERROR", e)
             return False
         return True
+    def process_args(self):
+        # key=value arguments the JS process reads on startup
+        return [f"key={self.key}", f"id={self.ID}", f"wire={self.wire}"]
     def kill_process(self):
         if not self.has_active_process:
             self.log("killing process", "NONEXISTENT")
@@ -113,12 +237,15 @@ class Process:
             return False
         self.log("opening pipe")
         try:
+            # nonblocking fails right away instead of waiting when the reader is not up yet, and update_pipe retries
             self._pipe = os.open(os.path.join(os.path.split(os.path.abspath(__file__))[0], f"._{self.key}_{self.ID}"),
-                                 os.O_WRONLY)
+                                 os.O_WRONLY | (os.O_NONBLOCK if self.nonblocking else 0))
             self.log("opened pipe")
         except Exception as e:
             self.log("opening pipe", "ERROR", e)
             return False
+        self._resync_pending = False
+        self.resync()
         return True
     def close_pipe(self):
         if not self.has_active_pipe:
@@ -127,8 +254,9 @@ class Process:
         self.log("closing pipe")
         try:
             os.close(self._pipe)
-            os.remove(os.path.join(os.path.split(os.path.abspath(__file__))[0], f"._{self.key}_{self.ID}"))
             self._pipe = None
+            self.drop_frames()
+            os.remove(os.path.join(os.path.split(os.path.abspath(__file__))[0], f"._{self.key}_{self.ID}"))
             self.log("closed pipe")
         except Exception as e:
             self.log("closing pipe", "ERROR", e)
@@ -150,26 +278,252 @@ class Process:
         self._pipe_poll_periodic = t
         if not self.has_active_pipe:
             return False
-        self.queue("poll")
+        # keyed so a pending poll is reused instead of cutting the queue in two for coalescing
+        self.queue("poll", key="poll")
         return True
 
-    def queue(self, data):
-        self._queue.append(data)
-        return self.attempt_dequeue()
+    def queue(self, data, key=None):
+        # a keyed packet replaces the pending packet with the same key in place, so only the latest value is sent
+        # unkeyed packets keep their place and nothing after them merges with anything before them
+        if len(self._queue) == 0:
+            self._queue_t = time.time()
+        if key is None:
+            self._queue.append(data)
+            self._queue_keys.clear()
+        elif key in self._queue_keys:
+            self._queue[self._queue_keys[key]] = data
+        else:
+            self._queue_keys[key] = len(self._queue)
+            self._queue.append(data)
+        if not self.autoflush:
+            return False
+        if self.rate is None:
+            return self.attempt_dequeue()
+        return self.update_flush()
     def attempt_dequeue(self):
         if not self.has_active_pipe:
             return False
-        if len(self._queue) > 0:
+        if self._resync_pending and len(self._frames) == 0:
+            # frames were dropped, the reader has caught up now so it gets brought up to date
+            self._resync_pending = False
+            self.resync()
+        # with coalesce, a full buffer leaves packets in the queue where repeated changes merge until there is room
+        if len(self._queue) > 0 and (self.overflow != "coalesce" or self.bytes_buffered < self.buffer_size):
+            t = time.time()
+            messages = len(self._queue)
+            frame = ptk.wire.encode(self._queue, self.wire)
+            # the frame has to fit as a whole, unless nothing is buffered and it could never fit
+            if self.overflow == "coalesce" and self.bytes_buffered > 0 and self.bytes_buffered + len(frame) > self.buffer_size:
+                self.write_frames()
+                return True
+            if self._recorder is not None:
+                self._recorder.write(self._queue)
+            self._queue.clear()
+            self._queue_keys.clear()
+            self._frames.append(frame)
+            self._bytes_buffered += len(frame)
+            if self.overflow == "drop-oldest" and self.bytes_buffered > self.buffer_size:
+                self.drop_frames(keep=1)
+            self.write_frames()
+            self.measure_flush(t, messages, len(frame))
+            return True
+        self.write_frames()
+        return True
+    def measure_flush(self, t, messages, size):
+        # t is when the frame started encoding, latency counts from when its first message was queued
+        now = time.time()
+        written = self.bytes_written - self._frame_written
+        elapsed = t - self._frame_t
+        self._frame_t = t
+        self._frame_written = self.bytes_written
+        stats = {
+            "t": t,
+            "messages": messages,
+            "bytes": size,
+            "written": written,
+            "buffered": self.bytes_buffered,
+            "latency": now - self._queue_t,
+            "duration": now - t,
+        }
+        if self.adaptive and self.rate is not None:
+            self._frame_bytes = size if self._frame_bytes == 0 else 0.8 * self._frame_bytes + 0.2 * size
+            # a pipe that is behind leaves bytes buffered, or if it blocks, takes much of the frame to write
+            if self.bytes_buffered > 0 or stats["duration"] > 0.5 / self._frame_rate:
+                # fewer frames of what the pipe measurably takes, repeated changes merge in the queue in between
+                throughput = written / max(elapsed if self.nonblocking else stats["duration"], 1e-6)
+                self._frame_rate = max(self.min_rate, min(self._frame_rate * 0.9, throughput / max(self._frame_bytes, 1)))
+            else:
+                self._frame_rate = min(self.rate, self._frame_rate * 1.05)
+        stats["rate"] = self._frame_rate
+        self._flushes += 1
+        self._flush_stats.append(stats)
+        return stats
+    def write_frames(self):
+        while len(self._frames) > 0:
+            frame = self._frames[0]
             try:
-                os.write(self._pipe, (json.dumps(self._queue)+"§§§").encode("utf-8"))
-                self._queue.clear()
+                n = os.write(self._pipe, memoryview(frame)[self._frame_offset:])
+            except BlockingIOError:
+                # the reader is behind, the rest waits for the next dequeue
+                return False
             except Exception as e:
-                self.log("attempt_dequeue", "ERROR", e)
+                self.log("write_frames", "ERROR", e)
                 self.close_pipe()
+                return False
+            self._bytes_written += n
+            self._bytes_buffered -= n
+            self._frame_offset += n
+            if self._frame_offset >= len(frame):
+                self._frames.popleft()
+                self._frame_offset = 0
+        return True
+    def drop_frames(self, keep=0):
+        # drops the oldest whole frames until the buffer fits, but never the newest keep frames or a partly written one
+        # without a pipe everything goes, since a new reader cannot take the rest of a partial frame
+        dropped = 0
+        while len(self._frames) > keep and (not self.has_active_pipe or self.bytes_buffered > self.buffer_size):
+            i = 1 if self._frame_offset > 0 and self.has_active_pipe else 0
+            if i >= len(self._frames) - keep:
+                break
+            frame = self._frames[i]
+            del self._frames[i]
+            n = len(frame) - (self._frame_offset if i == 0 else 0)
+            if i == 0:
+                self._frame_offset = 0
+            self._bytes_buffered -= n
+            self._bytes_dropped += n
+            dropped += 1
+        if dropped > 0:
+            self.log("drop_frames", dropped)
+            self._resync_pending = self.has_active_pipe
+        return dropped
+    def resync(self):
+        # called when the reader may have missed messages, after the pipe opens or once dropped frames are behind it
+        # subclasses put whatever brings a fresh reader up to date in the queue, without dequeueing
+        pass
+
+    def flush(self):
+        # sends everything pending as one frame, what gets queued meanwhile waits for the next frame
+        self._flush_periodic = time.time()
+        self.queue_pending()
+        return self.attempt_dequeue()
+    def queue_pending(self):
+        # subclasses queue whatever they hold back until a flush
+        pass
+    def update_flush(self):
+        # flushes at most once a frame
+        if self.frame_rate is not None and time.time() - self._flush_periodic < 1 / self.frame_rate:
+            return False
+        self.flush()
         return True
     
     def update(self):
         self.update_process()
         self.update_pipe()
         self.update_pipe_poll()
-        self.attempt_dequeue()
+        self.update_flush()
+
+    @classmethod
+    def session(cls, *, rate=60, **kwargs):
+        return Session(cls(nonblocking=True, start=False, **kwargs), rate=rate)
+
+
+class Session:
+    # asyncio driver of a nonblocking process: starts it, flushes it at rate, and keeps the process and pipe alive
+    def __init__(self, process, *, rate=60):
+        if not isinstance(process, Process):
+            raise Exception("Process parameter is not of class Process")
+        if not process.nonblocking:
+            raise Exception("Process is not nonblocking")
+        self._process = process
+
+        self.rate = rate
+
+        self._tasks = []
+        self._writer = None
+        self._waiters = []
+
+    @property
+    def process(self):
+        return self._process
+
+    @property
+    def rate(self):
+        return self.process.rate
+    @rate.setter
+    def rate(self, v):
+        # a session always flushes on a schedule
+        self.process.rate = v if v is not None else 60
+
+    async def __aenter__(self):
+        self.process.autoflush = False
+        self.process.start_process()
+        self.process.open_pipe()
+        self._tasks = [
+            asyncio.create_task(self.run_flush()),
+            asyncio.create_task(self.run_supervise()),
+        ]
+        return self
+    async def __aexit__(self, *a):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.flush()
+        try:
+            await asyncio.wait_for(self.drain(0), 1)
+        except asyncio.TimeoutError:
+            pass
+        self.watch(None)
+        self.process.close_pipe()
+        self.process.kill_process()
+        return False
+
+    def flush(self):
+        self.process.flush()
+        self.watch()
+        self.wake()
+    async def run_flush(self):
+        while True:
+            self.flush()
+            await asyncio.sleep(1 / self.process.frame_rate)
+    async def run_supervise(self):
+        while True:
+            self.process.update_process()
+            self.process.update_pipe()
+            self.process.update_pipe_poll()
+            await asyncio.sleep(0.25)
+
+    def watch(self, pipe=False):
+        # while bytes are buffered the loop calls back as soon as the pipe has room, instead of waiting for the next flush
+        if pipe is False:
+            pipe = self.process._pipe if self.process.has_active_pipe and self.process.bytes_buffered > 0 else None
+        if pipe == self._writer:
+            return
+        loop = asyncio.get_running_loop()
+        if self._writer is not None:
+            loop.remove_writer(self._writer)
+        self._writer = pipe
+        if self._writer is not None:
+            loop.add_writer(self._writer, self.writable)
+    def writable(self):
+        self.process.write_frames()
+        self.watch()
+        self.wake()
+
+    def wake(self):
+        waiters = self._waiters
+        self._waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+    async def drain(self, limit=None):
+        # waits until at most limit bytes are buffered, half the buffer by default
+        limit = self.process.buffer_size // 2 if limit is None else limit
+        while self.process.has_active_pipe and self.process.bytes_buffered > limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+    async def queue(self, data, key=None):
+        self.process.queue(data, key)
+        await self.drain()
@@ -0,0 +1,117 @@
+import array
+import json
+import struct
+import sys
+
+
+FORMATS = ("json", "binary")
+
+# binary frames are a u32 body length followed by segments, all little endian
+# segment 0: u32 length, then a utf-8 json list of packets
+# segment 1: u16 string count, each string as u8 length and utf-8, then u32 change count n,
+#            n u16 robot id indices, n u16 key indices, n f64 values
+# segment 2: one "cs" command, u32 robot count n, u8 key count m, the robot ids then the keys as u8 length and utf-8,
+#            then m rows of n f64 values
+JSON_SEGMENT = 0
+CHANGE_SEGMENT = 1
+COLUMN_SEGMENT = 2
+
+
+def to_json(v):
+    # numpy arrays and numbers, from "cs" commands
+    if hasattr(v, "tolist"):
+        return v.tolist()
+    raise TypeError(f"Object of type {v.__class__.__name__} is not JSON serializable")
+
+def encode_json(queue):
+    return (json.dumps(queue, default=to_json)+"§§§").encode("utf-8")
+
+def is_numeric_change(data):
+    # bools stay json so they arrive as bools, and strings have to fit a u8 length
+    if not (isinstance(data, list) and len(data) == 4 and data[0] == "c"):
+        return False
+    if not (isinstance(data[1], str) and len(data[1]) < 64 and isinstance(data[2], str) and len(data[2]) < 64):
+        return False
+    return type(data[3]) in (int, float)
+
+def is_column_change(data):
+    if not (isinstance(data, list) and len(data) == 4 and data[0] == "cs" and hasattr(data[3], "tobytes")):
+        return False
+    if len(data[2]) > 255 or data[3].shape != (len(data[2]), len(data[1])):
+        return False
+    return all(isinstance(s, str) and len(s) < 64 for s in [*data[1], *data[2]])
+
+def pack_array(typecode, values):
+    a = array.array(typecode, values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+def encode_binary(queue):
+    body = bytearray()
+
+    packets = []
+    strings = {}
+    ids = []
+    keys = []
+    values = []
+
+    def flush_packets():
+        data = json.dumps(packets, default=to_json).encode("utf-8")
+        body.extend(struct.pack("<BI", JSON_SEGMENT, len(data)))
+        body.extend(data)
+        packets.clear()
+    def flush_changes():
+        body.extend(struct.pack("<BH", CHANGE_SEGMENT, len(strings)))
+        for s in strings:
+            s = s.encode("utf-8")
+            body.extend(struct.pack("<B", len(s)))
+            body.extend(s)
+        body.extend(struct.pack("<I", len(values)))
+        body.extend(pack_array("H", ids))
+        body.extend(pack_array("H", keys))
+        body.extend(pack_array("d", values))
+        strings.clear()
+        ids.clear()
+        keys.clear()
+        values.clear()
+
+    def flush_columns(ids, keys, rows):
+        body.extend(struct.pack("<BIB", COLUMN_SEGMENT, len(ids), len(keys)))
+        for s in [*ids, *keys]:
+            s = s.encode("utf-8")
+            body.extend(struct.pack("<B", len(s)))
+            body.extend(s)
+        body.extend(rows.astype("<f8").tobytes())
+
+    for data in queue:
+        if is_column_change(data):
+            if len(packets) > 0:
+                flush_packets()
+            if len(values) > 0:
+                flush_changes()
+            flush_columns(*data[1:])
+            continue
+        if not is_numeric_change(data):
+            if len(values) > 0:
+                flush_changes()
+            packets.append(data)
+            continue
+        if len(packets) > 0:
+            flush_packets()
+        if len(strings) > 65533:
+            flush_changes()
+        ids.append(strings.setdefault(data[1], len(strings)))
+        keys.append(strings.setdefault(data[2], len(strings)))
+        values.append(data[3])
+    if len(packets) > 0:
+        flush_packets()
+    if len(values) > 0:
+        flush_changes()
+
+    return struct.pack("<I", len(body)) + body
+
+def encode(queue, wire):
+    if wire == "binary":
+        return encode_binary(queue)
+    return encode_json(queue)
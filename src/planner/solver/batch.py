@@ -0,0 +1,131 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import traceback
+
+# solves many paths at once across a process pool
+#   python batch.py paths/            every data.in under the directory, data.out and stdout.log written beside each
+#   python batch.py paths.json        a json array of data.in objects (or {"name": ..., "data": ...}), written to --out
+
+
+def jobs_from_dir(root):
+    jobs = []
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        if "data.in" not in filenames:
+            continue
+        jobs.append({
+            'name': os.path.relpath(dirpath, root),
+            'input': os.path.join(dirpath, "data.in"),
+            'output': os.path.join(dirpath, "data.out"),
+            'log': os.path.join(dirpath, "stdout.log"),
+        })
+    return jobs
+
+def jobs_from_file(path, out):
+    with open(path, "r") as file:
+        entries = json.load(file)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path} does not hold a json array")
+    jobs = []
+    for i, entry in enumerate(entries):
+        name = str(entry.get('name', i)) if 'data' in entry else str(i)
+        jobs.append({
+            'name': name,
+            'data': entry['data'] if 'data' in entry else entry,
+            'output': os.path.join(out, f"{name}.out"),
+            'log': os.path.join(out, f"{name}.log"),
+        })
+    return jobs
+
+def run(job):
+    # runs in a worker, any failure is reported back instead of raised so the rest of the batch carries on
+    t = time.time()
+    stdout = os.dup(1)
+    stderr = os.dup(2)
+    try:
+        with open(job['log'], "w") as log:
+            # ipopt writes to the file descriptors directly, so swap those rather than sys.stdout
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+            try:
+                import solver
+                data = job.get('data')
+                if data is None:
+                    with open(job['input'], "r") as file:
+                        data = json.load(file)
+                stats = {}
+                result = solver.solve(data, stats)
+                with open(job['output'], "w") as file:
+                    json.dump(result, file, indent=4)
+                if data['config'].get('instrument', False):
+                    solver.write_stats(os.path.splitext(job['output'])[0] + ".stats", {**stats, 'ok': True, 'total': time.time() - t})
+            except Exception as e:
+                traceback.print_exc()
+                return {'name': job['name'], 'ok': False, 'error': f"{type(e).__name__}: {e}", 'time': time.time() - t}
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(stdout, 1)
+                os.dup2(stderr, 2)
+    finally:
+        os.close(stdout)
+        os.close(stderr)
+    return {'name': job['name'], 'ok': True, 'output': job['output'], 'time': time.time() - t}
+
+def solve_all(jobs, workers=None, report=print):
+    # returns one status per job, in job order
+    results = {}
+    pending = list(range(len(jobs)))
+    crashes = {}
+    while len(pending) > 0:
+        retry = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run, jobs[i]): i for i in pending}
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    # a worker died outright, every job still in the pool fails with it
+                    crashes[i] = crashes.get(i, 0) + 1
+                    if crashes[i] < 2:
+                        retry.append(i)
+                        continue
+                    results[i] = {'name': jobs[i]['name'], 'ok': False, 'error': "solver process crashed", 'time': 0}
+                r = results[i]
+                report(f"{'ok' if r['ok'] else 'FAILED':>6}  {r['time']:7.2f}s  {r['name']}" + ("" if r['ok'] else f"  {r['error'].splitlines()[-1]}"))
+        pending = retry
+    return [results[i] for i in range(len(jobs))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve many planner paths in parallel")
+    parser.add_argument("source", help="directory searched for data.in files, or a json file holding an array of inputs")
+    parser.add_argument("--out", default=None, help="output directory for a json array source")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        jobs = jobs_from_dir(args.source)
+        out = args.source
+    else:
+        out = args.out or os.path.splitext(args.source)[0] + "_out"
+        os.makedirs(out, exist_ok=True)
+        jobs = jobs_from_file(args.source, out)
+
+    t = time.time()
+    results = solve_all(jobs, args.workers)
+    t = time.time() - t
+
+    failed = sum(not r['ok'] for r in results)
+    print(f"{len(results) - failed}/{len(results)} solved in {t:.2f}s")
+    with open(os.path.join(out, "batch.json"), "w") as file:
+        json.dump({'time': t, 'results': results}, file, indent=4)
+    sys.exit(1 if failed > 0 else 0)
+
+if __name__ == "__main__":
+    main()
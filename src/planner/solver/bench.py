@@ -0,0 +1,244 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import traceback
+
+from constants import Config
+from util import corner_reach
+
+# times the solver on synthetic paths, and compares against an earlier run
+#   python bench.py                                  every case, results written to bench.json
+#   python bench.py --compare old.json               also flags cases that got slower, took more iterations or found longer paths
+#   python bench.py --only o40 --repeat 3 --inputs in/   a subset, best of 3, with each data.in kept
+
+FIELD = (16.54, 8.21)
+
+ROBOT = {
+    'side_length': 0.84,
+    'mass': 60,
+    'moment_of_inertia': 6,
+    'efficiency_percent': 0.7,
+    'free_percent': 1,
+    'FOC': True,
+    #every case is a fresh solve
+    'warm_start': False,
+    'result_cache': False,
+}
+
+# nodes: waypoints, obstacles: how many, density: "spread" over the field or "path" along the straight line between nodes
+# headings: "all", "ends" or "first" of the nodes have a heading (the solver needs one on the first node)
+# velocities: whether middle nodes have a set velocity
+SUITE = [
+    {'nodes': 2, 'obstacles': 0},
+    {'nodes': 4, 'obstacles': 0},
+    {'nodes': 8, 'obstacles': 0},
+    {'nodes': 4, 'obstacles': 0, 'headings': "ends"},
+    {'nodes': 4, 'obstacles': 0, 'velocities': True},
+    {'nodes': 4, 'obstacles': 10, 'density': "spread"},
+    {'nodes': 4, 'obstacles': 10, 'density': "path"},
+    {'nodes': 4, 'obstacles': 40, 'density': "spread"},
+    {'nodes': 8, 'obstacles': 20, 'density': "path"},
+]
+
+# a metric is a regression when it grows by more than the threshold and by more than its floor
+METRICS = {
+    'build': 0.05,
+    'solve': 0.05,
+    'resample': 0.005,
+    'total': 0.05,
+    'iterations': 2,
+    'memory': 10,
+    'path_time': 0.01,
+}
+
+
+def case_name(case):
+    name = f"n{case['nodes']}_o{case['obstacles']}"
+    if case['obstacles'] > 0:
+        name += f"_{case.get('density', 'spread')}"
+    if case.get('headings', "all") != "all":
+        name += f"_h{case['headings']}"
+    if case.get('velocities', False):
+        name += "_v"
+    return name
+
+def synthetic(case, seed=0):
+    # a data.in for the case, the same for the same case and seed
+    rng = random.Random(f"{case_name(case)}/{seed}")
+    w, h = FIELD
+    margin = corner_reach(Config(ROBOT)) + 0.2
+
+    nodes = []
+    while len(nodes) < case['nodes']:
+        x, y = rng.uniform(margin, w - margin), rng.uniform(margin, h - margin)
+        #consecutive nodes far enough apart to be a path, not so far that every case is one long drive
+        if len(nodes) > 0 and not 1.5 < math.hypot(x - nodes[-1]['x'], y - nodes[-1]['y']) < 6:
+            continue
+        nodes.append({'x': x, 'y': y, 'vx': None, 'vy': None, 'vt': None, 'theta': None})
+
+    headings = case.get('headings', "all")
+    for i, node in enumerate(nodes):
+        if headings == "all" or (headings == "ends" and i in (0, len(nodes) - 1)) or i == 0:
+            node['theta'] = rng.uniform(-math.pi, math.pi)
+    for node in (nodes[0], nodes[-1]):
+        node.update({'vx': 0, 'vy': 0, 'vt': 0})
+    if case.get('velocities', False):
+        for i in range(1, len(nodes) - 1):
+            #toward the next node at a slow walk
+            dx, dy = nodes[i+1]['x'] - nodes[i]['x'], nodes[i+1]['y'] - nodes[i]['y']
+            d = math.hypot(dx, dy)
+            nodes[i].update({'vx': 0.5 * dx / d, 'vy': 0.5 * dy / d, 'vt': 0})
+
+    obstacles = []
+    tries = 0
+    while len(obstacles) < case['obstacles'] and tries < 10000:
+        tries += 1
+        r = rng.uniform(0.15, 0.5)
+        if case.get('density', "spread") == "path":
+            k = rng.randrange(len(nodes) - 1)
+            u = rng.random()
+            x = nodes[k]['x'] + u * (nodes[k+1]['x'] - nodes[k]['x']) + rng.gauss(0, 1)
+            y = nodes[k]['y'] + u * (nodes[k+1]['y'] - nodes[k]['y']) + rng.gauss(0, 1)
+        else:
+            x, y = rng.uniform(0, w), rng.uniform(0, h)
+        #nodes stay reachable, the robot has to fit at every node
+        if any(math.hypot(x - node['x'], y - node['y']) < r + margin for node in nodes):
+            continue
+        obstacles.append({'x': x, 'y': y, 'radius': r})
+
+    return {
+        'config': {'map_w': w, 'map_h': h, **ROBOT},
+        'nodes': nodes,
+        'obstacles': obstacles,
+    }
+
+def peak_memory():
+    # megabytes, ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+def run(data):
+    # runs in a fresh worker so peak memory is this case's alone, solver output goes to /dev/null
+    t = time.time()
+    stdout = os.dup(1)
+    try:
+        with open(os.devnull, "w") as null:
+            sys.stdout.flush()
+            os.dup2(null.fileno(), 1)
+            try:
+                import solver
+                stats = {}
+                result = solver.solve(data, stats)
+            except Exception as e:
+                return {'ok': False, 'error': f"{type(e).__name__}: {e}", 'trace': traceback.format_exc()}
+            finally:
+                sys.stdout.flush()
+                os.dup2(stdout, 1)
+    finally:
+        os.close(stdout)
+    return {
+        'ok': True,
+        **stats,
+        'total': time.time() - t,
+        'memory': peak_memory(),
+        'path_time': result['dt'] * (len(result['state']) - 1),
+    }
+
+def bench(cases, repeat=1, seed=0, inputs=None, report=print):
+    results = []
+    for case in cases:
+        name = case_name(case)
+        data = synthetic(case, seed)
+        if inputs is not None:
+            os.makedirs(os.path.join(inputs, name), exist_ok=True)
+            with open(os.path.join(inputs, name, "data.in"), "w") as file:
+                json.dump(data, file, indent=4)
+        runs = []
+        for _ in range(repeat):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+                runs.append(pool.submit(run, data).result())
+            if not runs[-1]['ok']:
+                break
+        if runs[-1]['ok']:
+            #the best of the repeats is the least noisy, iterations and path time do not change between them
+            result = {k: min(r[k] for r in runs) if k in METRICS else v for k, v in runs[0].items()}
+        else:
+            result = runs[-1]
+        result = {'name': name, 'case': case, **result}
+        results.append(result)
+        if result['ok']:
+            report(f"{name:>22}  build {result['build']:6.2f}s  solve {result['solve']:6.2f}s  {result['iterations']:4d} it  "
+                   f"resample {result['resample']*1e3:6.1f}ms  total {result['total']:6.2f}s  {result['memory']:6.0f}MB  "
+                   f"path {result['path_time']:5.2f}s  {result['constraints']} constraints")
+        else:
+            report(f"{name:>22}  FAILED  {result['error'].splitlines()[-1]}")
+    return results
+
+def compare(results, baseline, threshold):
+    # regressions against an earlier run, as lines to print
+    old = {r['name']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        o = old.get(r['name'])
+        if o is None or not o['ok']:
+            continue
+        if not r['ok']:
+            regressions.append(f"{r['name']}: now fails, {r['error'].splitlines()[-1]}")
+            continue
+        for k, floor in METRICS.items():
+            if k not in o or k not in r:
+                continue
+            if r[k] > o[k] * (1 + threshold) and r[k] - o[k] > floor:
+                regressions.append(f"{r['name']}: {k} {o[k]:.4g} -> {r[k]:.4g} ({(r[k] / o[k] - 1) * 100 if o[k] else math.inf:+.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the planner solver on synthetic paths")
+    parser.add_argument("--out", default="bench.json", help="where to write the results")
+    parser.add_argument("--compare", default=None, help="results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative growth of a metric that counts as a regression")
+    parser.add_argument("--only", default=None, help="only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the best is kept")
+    parser.add_argument("--seed", type=int, default=0, help="varies the synthetic paths")
+    parser.add_argument("--inputs", default=None, help="directory to write each case's data.in to")
+    args = parser.parse_args()
+
+    cases = [case for case in SUITE if args.only is None or args.only in case_name(case)]
+    results = bench(cases, max(1, args.repeat), args.seed, args.inputs)
+
+    import casadi
+    with open(args.out, "w") as file:
+        json.dump({
+            'time': time.time(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'casadi': casadi.__version__,
+            'machine': platform.platform(),
+            'results': results,
+        }, file, indent=4)
+
+    failed = sum(not r['ok'] for r in results)
+    print(f"{len(results) - failed}/{len(results)} solved, written to {args.out}")
+
+    if args.compare is None:
+        sys.exit(1 if failed > 0 else 0)
+    with open(args.compare, "r") as file:
+        baseline = json.load(file)
+    if baseline.get('seed') != args.seed:
+        print(f"warning: {args.compare} used seed {baseline.get('seed')}, the paths differ")
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print("REGRESSION", line)
+    print(f"{len(regressions)} regressions against {args.compare}")
+    sys.exit(1 if failed > 0 or len(regressions) > 0 else 0)
+
+if __name__ == "__main__":
+    main()
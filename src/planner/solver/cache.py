@@ -0,0 +1,105 @@
+import functools
+import hashlib
+import json
+import os
+
+
+CACHE_DIR = os.path.join(os.path.split(os.path.abspath(__file__))[0], "cache")
+
+def digest(value):
+    # content hash of any json value, independent of key order and formatting
+    text = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def source_digest():
+    # hash of the solver sources, so results from an older solver are never served
+    # taken once per process, so a long running daemon reports the code it actually runs
+    h = hashlib.sha256()
+    root = os.path.split(os.path.abspath(__file__))[0]
+    for name in sorted(os.listdir(root)):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(root, name), "rb") as file:
+            h.update(file.read())
+    return h.hexdigest()
+
+
+class DiskCache:
+    # directory of json entries, least recently used entries are evicted past the size cap
+    # file modification times act as the lru clock so several solver processes can share a directory
+    def __init__(self, name, size=32, root=CACHE_DIR):
+        self.root = os.path.join(root, name)
+        self.size = max(0, int(size))
+
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def keys(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [name[:-5] for name in os.listdir(self.root) if name.endswith(".json")]
+
+    def read(self, key):
+        try:
+            with open(self.path(key), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        entry = self.read(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(key)
+        return entry
+
+    def report(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self.keys())}/{self.size} entries"
+
+    def touch(self, key):
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def put(self, key, entry):
+        if self.size <= 0:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.path(key) + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        stamps = []
+        for key in self.keys():
+            try:
+                stamps.append((os.path.getmtime(self.path(key)), key))
+            except OSError:
+                pass
+        stamps.sort(reverse=True)
+        for _, key in stamps[self.size:]:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+_caches = {}
+
+def open_cache(name, size=32):
+    # one DiskCache per directory and process, so hit and miss counts add up across solves
+    if name not in _caches:
+        _caches[name] = DiskCache(name, size)
+    cache = _caches[name]
+    cache.size = max(0, int(size))
+    return cache
@@ -1,33 +1,40 @@
-import json
+import functools
+from motor import Motor
 
-m = 67.5 #weight in kg cad
-l = 0.53 / 2 #side length in meters
-
-I = ((70979) * 1.829e-5) + ((2.811 * 10**5) * 1.829e-5) # from cCAD
-
-with open('data.in', 'r') as file:
-    data = json.load(file)
+pi = 3.1415
 
-config = data['config']
+wheel_radius = 0.0504 #meters
 
-l = config['side_length'] / 2
-m = config['mass']
-I = config['moment_of_inertia']
 
-free_speed_percent = config['free_percent']
+class Config:
+    # robot constants for one solve, built once from the config of a data.in
+    # the motor model is only worked out when something first asks for it
+    def __init__(self, config):
+        self.l = config['side_length'] / 2
+        self.m = config['mass']
+        self.I = config['moment_of_inertia']
 
-pi = 3.1415
-pie = 3.142
+        self.free_speed_percent = config['free_percent']
+        self.efficiency_tweak = config['efficiency_percent']
+        self.FOC = not not config['FOC']
+        self.motor_type = config.get('motor', "kraken")
 
-plot = True
+        self.wheel_radius = wheel_radius
 
-drive_gr = 1.0 / ((16.0 / 50) * (28.0 / 16) * (15.0 / 45))
-    
-motor_free_speed = 6000 #rpm
+    @functools.cached_property
+    def motor(self):
+        return Motor(self.motor_type, FOC=self.FOC, efficiency_tweak=self.efficiency_tweak)
 
-if config['FOC']:
-    motor_free_speed = 5800
+    @property
+    def drive_gr(self):
+        return self.motor.drive_gr
 
-wheel_radius = 0.0504 #meters
+    @property
+    def max_module_ground_speed(self):
+        return self.wheel_radius * 2 * pi * ((self.motor.free_speed_rpm / 60) / self.drive_gr)
 
-max_module_ground_speed = wheel_radius * 2 * pi * ((motor_free_speed / 60) / drive_gr)
+    @property
+    def key(self):
+        # everything the robot model depends on, so compiled functions can be kept per robot
+        # mass and inertia are inputs of the model, not part of it
+        return (self.l, self.free_speed_percent, self.efficiency_tweak, self.FOC, self.motor_type, self.wheel_radius)
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import select
+import socket
+import socketserver
+import sys
+import time
+import traceback
+
+import solver
+
+# resident solver, keeps casadi, the motor model and compiled step functions loaded between solves
+# speaks json lines, one request per line and one reply per line:
+#   {"id": 1, "data": {...data.in...}}       -> {"id": 1, "ok": true, "result": {...data.out...}, "time": 0.5, "stats": {...}}
+#                                               with "stream" set in the config, {"id": 1, "iterate": {...}} lines come first
+#   {"id": 2, "cmd": "ping"}                 -> {"id": 2, "ok": true}
+#   {"id": 3, "cmd": "stop"}                 -> {"id": 3, "ok": true}, then the daemon exits
+# either over stdin/stdout, or over a tcp socket on localhost with --port
+
+stopped = False
+last_active = time.time()
+
+def handle(line, send=None, cancelled=None):
+    # send, if given, writes a line back before the reply, which is how streamed iterates go out
+    # cancelled, if given, tells whether the client is gone, which stops the solve
+    global stopped, last_active
+    last_active = time.time()
+    try:
+        req = json.loads(line)
+    except ValueError as e:
+        return {'id': None, 'ok': False, 'error': f"bad request: {e}"}
+    id_ = req.get('id')
+    cmd = req.get('cmd', "solve")
+    if cmd == "ping":
+        return {'id': id_, 'ok': True}
+    if cmd == "stop":
+        stopped = True
+        return {'id': id_, 'ok': True}
+    if cmd != "solve":
+        return {'id': id_, 'ok': False, 'error': f"unknown command: {cmd}"}
+    t = time.time()
+    stats = {}
+    try:
+        emit = None
+        if send is not None and req['data']['config'].get('stream'):
+            emit = lambda iterate: send({'id': id_, 'iterate': iterate})
+        result = solver.solve(req['data'], stats, emit, cancelled)
+    except Exception as e:
+        if cancelled is not None and cancelled():
+            print("client disconnected, solve stopped")
+        else:
+            traceback.print_exc()
+        return {'id': id_, 'ok': False, 'error': f"{type(e).__name__}: {e}", 'time': time.time() - t, 'stats': stats}
+    finally:
+        last_active = time.time()
+    return {'id': id_, 'ok': True, 'result': result, 'time': time.time() - t, 'stats': stats}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def send(self, reply):
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+        self.wfile.flush()
+    def disconnected(self):
+        # a closed connection reads as empty without blocking, a pending next request is left in place
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return len(readable) > 0 and self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = handle(line.decode("utf-8"), self.send, self.disconnected)
+            try:
+                self.send(reply)
+            except OSError:
+                #the client gave up waiting
+                return
+            if stopped:
+                return
+
+
+def serve_stdio():
+    # replies go out on the real stdout, anything ipopt or the solver prints is moved to stderr
+    out = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    def send(reply):
+        out.write(json.dumps(reply) + "\n")
+        out.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        send(handle(line, send))
+        if stopped:
+            return
+
+def serve_tcp(port, idle):
+    with socketserver.TCPServer(("127.0.0.1", port), Handler) as server:
+        server.timeout = 1
+        with open(solver.DAEMON_FILE + ".tmp", "w") as file:
+            json.dump({'port': server.server_address[1], 'pid': os.getpid()}, file)
+        os.replace(solver.DAEMON_FILE + ".tmp", solver.DAEMON_FILE)
+        print(f"listening on 127.0.0.1:{server.server_address[1]}")
+        try:
+            while not stopped:
+                server.handle_request()
+                if idle > 0 and time.time() - last_active > idle:
+                    print("idle, exiting")
+                    break
+        finally:
+            try:
+                os.remove(solver.DAEMON_FILE)
+            except OSError:
+                pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident planner solver")
+    parser.add_argument("--port", type=int, default=None, help="serve on this localhost tcp port instead of stdin/stdout, 0 picks a free one")
+    parser.add_argument("--idle", type=float, default=900, help="seconds without requests before a tcp daemon exits, 0 never exits")
+    args = parser.parse_args()
+
+    if args.port is None:
+        serve_stdio()
+    else:
+        serve_tcp(args.port, args.idle)
+
+if __name__ == "__main__":
+    main()
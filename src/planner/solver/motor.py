@@ -1,43 +1,47 @@
-import json
-
-high_tide_mode = False
-
-efficiency_tweak = 0.7
-
-with open('data.in', 'r') as file:
-    data = json.load(file)
-
-config = data['config']
-
-efficiency_tweak = config['efficiency_percent']
-FOC = config['FOC']
-
 nominal_voltage = 12
 
 drive_gr_falcon = 6.75
 drive_gr_kraken = 1.0 / ((16.0 / 50) * (28.0 / 16) * (15.0 / 45))
 
-stall_torque = 7.09 * drive_gr_kraken * efficiency_tweak
+# stall torque (Nm), stall current (A), free current (A), free speed (rpm), as (without FOC, with FOC)
+MOTORS = {
+    "kraken": ((7.09, 366, 2.0, 6000), (9.37, 483, 2, 5800)),
+    "falcon": ((4.69, 257, 1.5, 6380), (5.84, 304, 1.5, 6080)),
+}
+
+DRIVE_GEAR_RATIOS = {
+    "kraken": drive_gr_kraken,
+    "falcon": drive_gr_falcon,
+}
+
+
+class Motor:
+    # drive motor model, torque and speed are taken through the drive gearing to the wheel axle
+    def __init__(self, type="kraken", *, FOC=False, efficiency_tweak=0.7):
+        if type not in MOTORS:
+            raise ValueError(f"Unknown motor type: {type}")
+        self.type = type
+        self.FOC = not not FOC
+        self.efficiency_tweak = efficiency_tweak
 
-stall_current = 366
-free_current = 2.0
+        stall_torque, stall_current, free_current, free_speed = MOTORS[type][self.FOC]
 
-free_speed = 6000 / drive_gr_kraken
+        self.drive_gr = DRIVE_GEAR_RATIOS[type]
+        self.free_speed_rpm = free_speed
 
-if FOC:
-    stall_torque = 9.37 * drive_gr_kraken * efficiency_tweak
-    stall_current = 483
-    free_current = 2
-    free_speed = 5800 / drive_gr_kraken
+        self.stall_torque = stall_torque * self.drive_gr * efficiency_tweak
+        self.stall_current = stall_current
+        self.free_current = free_current
+        self.free_speed = free_speed / self.drive_gr
 
-rOhms = nominal_voltage / stall_current
+        self.rOhms = nominal_voltage / self.stall_current
 
-Kv_rad_per_sec_per_volt = (2 * 3.1415 * free_speed / 60) / (nominal_voltage - rOhms * free_current)
+        self.Kv_rad_per_sec_per_volt = (2 * 3.1415 * self.free_speed / 60) / (nominal_voltage - self.rOhms * self.free_current)
 
-Kt_NM_per_amp = stall_torque / stall_current
+        self.Kt_NM_per_amp = self.stall_torque / self.stall_current
 
-def get_current(rad_per_s, voltage):
-    return -1 / Kv_rad_per_sec_per_volt / rOhms * rad_per_s + 1 / rOhms * voltage
+    def get_current(self, rad_per_s, voltage):
+        return -1 / self.Kv_rad_per_sec_per_volt / self.rOhms * rad_per_s + 1 / self.rOhms * voltage
 
-def get_torque(current):
-    return current * Kt_NM_per_amp
+    def get_torque(self, current):
+        return current * self.Kt_NM_per_amp
@@ -0,0 +1,53 @@
+import math
+import numpy as np
+from util import corner_offsets, corner_reach
+
+
+class ObstacleGrid:
+    # uniform hash grid over the obstacle circles, so a point only looks at the obstacles around it
+    def __init__(self, obx, oby, obr, cell=1):
+        self.x = np.asarray(obx, dtype=float)
+        self.y = np.asarray(oby, dtype=float)
+        self.r = np.asarray(obr, dtype=float)
+
+        self.cell = max(float(cell), 1e-3)
+        self.cells = {}
+
+        for o in range(len(self.x)):
+            for key in self.keys(self.x[o], self.y[o], self.r[o]):
+                self.cells.setdefault(key, []).append(o)
+
+    def keys(self, x, y, reach):
+        i0 = math.floor((x - reach) / self.cell)
+        i1 = math.floor((x + reach) / self.cell)
+        j0 = math.floor((y - reach) / self.cell)
+        j1 = math.floor((y + reach) / self.cell)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def near(self, x, y, reach):
+        # obstacles whose circle comes within reach of (x, y)
+        found = set()
+        for key in self.keys(x, y, reach):
+            found.update(self.cells.get(key, []))
+        return [o for o in sorted(found) if (self.x[o] - x)**2 + (self.y[o] - y)**2 <= (self.r[o] + reach)**2]
+
+    def pairs(self, xs, ys, reach):
+        # (control index, obstacle) pairs that need a constraint for a path through xs, ys
+        return [(i, o) for i in range(len(xs)) for o in self.near(xs[i], ys[i], reach)]
+
+    def violations(self, xs, ys, thetas, cfg, tolerance=1e-6):
+        # (control index, obstacle) pairs where a corner of the robot sits inside the obstacle
+        found = []
+        offsets = corner_offsets(cfg)
+        reach = corner_reach(cfg)
+        for i in range(len(xs)):
+            c = math.cos(thetas[i])
+            s = math.sin(thetas[i])
+            for o in self.near(xs[i], ys[i], reach):
+                for dx, dy in offsets:
+                    cx = xs[i] + dx * c - dy * s - self.x[o]
+                    cy = ys[i] + dy * c + dx * s - self.y[o]
+                    if cx**2 + cy**2 < self.r[o]**2 - tolerance:
+                        found.append((i, o))
+                        break
+        return found
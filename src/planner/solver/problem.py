@@ -0,0 +1,438 @@
+import collections
+import math
+import time
+import casadi as ca
+import numpy as np
+from system import JIT_OPTIONS, map_steps, apply_dynamics_block, apply_kinematics_block, apply_kinematics2_block, apply_obstacles
+from obstacles import ObstacleGrid
+import warmstart
+from util import corner_reach, estimate_time
+
+# per-iteration values ipopt reports, kept for every iteration when instrumenting
+TRACE_KEYS = ['obj', 'inf_pr', 'inf_du', 'mu', 'd_norm', 'alpha_pr', 'alpha_du']
+
+def wrap_angles_to_least_delta(angles):
+    wrapped_angles = np.zeros_like(angles)
+    wrapped_angles[0] = angles[0]
+
+    for i in range(1, len(angles)):
+        delta = angles[i] - wrapped_angles[i - 1]
+        # Wrap the delta to be within [-π, π] range
+        delta = (delta + np.pi) % (2 * np.pi) - np.pi
+        wrapped_angles[i] = wrapped_angles[i - 1] + delta
+
+    return wrapped_angles
+
+
+def horizon(data, cfg):
+    # control point index of every node, and the initial dt of every segment
+    # by default every segment gets ct points, with adaptive_ct the count follows the segment length and expected speed
+    config = data['config']
+    nodes = data['nodes']
+    ct = config.get('ct', 25)
+
+    if not config.get('adaptive_ct', False):
+        N = ct * len(nodes) - ct #control points
+        way_i = np.linspace(0, N, len(nodes)).astype(int)
+        return way_i, [4.95/ct] * (len(nodes) - 1)
+
+    ct_dt = config.get('ct_dt', 0.05)
+    ct_min = config.get('ct_min', 5)
+    ct_max = config.get('ct_max', 50)
+
+    #full module force on every module, all pushing the same way
+    accel = 4 * cfg.motor.get_torque(70) / cfg.wheel_radius / cfg.m
+
+    counts = []
+    init_dts = []
+    for i in range(1, len(nodes)):
+        d = math.hypot(nodes[i]['x'] - nodes[i-1]['x'], nodes[i]['y'] - nodes[i-1]['y'])
+        speed = cfg.max_module_ground_speed * cfg.free_speed_percent * nodes[i].get('percent', 1)
+        t = estimate_time(d, speed, accel)
+        count = int(min(max(math.ceil(t / ct_dt), ct_min), ct_max))
+        counts.append(count)
+        init_dts.append(max(t, ct_dt) / count)
+
+    way_i = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+    return way_i, init_dts
+
+def coarsen(way_i, init_dts, factor):
+    # a sparser horizon over the same segments, keeping the time spent in each segment
+    counts = np.diff(way_i)
+    coarse = np.maximum(np.ceil(counts * factor), 2).astype(int)
+    coarse_dts = [init_dts[k] * counts[k] / coarse[k] for k in range(len(counts))]
+    return np.concatenate([[0], np.cumsum(coarse)]).astype(int), coarse_dts
+
+
+def problem_key(data, cfg, way_i, jit):
+    # everything a built problem cannot take as a parameter, paths with the same key share one
+    return (str(jit), tuple(map(int, way_i)), len(data['obstacles']),
+            tuple(map(tuple, warmstart.node_flags(data))), cfg.key)
+
+
+class Problem:
+    # the nlp over one horizon, built once and then solved for every path of the same structure
+    # node positions, headings, velocities and percents, the obstacles and the robot's mass and inertia are parameters
+    # only the (control index, obstacle) pairs with constraints grow from solve to solve, see add_obstacles
+    def __init__(self, data, cfg, way_i, jit=False):
+        self.cfg = cfg
+        self.way_i = way_i
+
+        N = int(way_i[-1]) #control points
+        n = len(data['nodes'])
+
+        self.opti = opti = ca.Opti()
+
+        x_n = 6 #state vars [x, y, theta, x_dot, y_dot, theta_dot]
+        u_n = 8 #input vars [F1x, F2x, F3x, F4x, F1y, F2y, F3y, F4y]
+        self.X = X = opti.variable(N+1, x_n)
+        self.U = U = opti.variable(N+1, u_n)
+
+        self.nodes = opti.parameter(n, 2) #x, y
+        self.headings = opti.parameter(n)
+        self.velocities = opti.parameter(n, 3) #vx, vy, vt
+        self.percents = opti.parameter(n)
+        self.obstacles = opti.parameter(len(data['obstacles']), 3) if len(data['obstacles']) > 0 else None #x, y, radius
+        self.robot = opti.parameter(2) #mass, moment of inertia
+
+        for i, node in enumerate(data['nodes']):
+            if node['vx'] is not None and node['vy'] is not None:
+                opti.subject_to(X[way_i[i], 3] == self.velocities[i, 0])
+                opti.subject_to(X[way_i[i], 4] == self.velocities[i, 1])
+                opti.subject_to(X[way_i[i], 5] == self.velocities[i, 2])
+            if node['theta'] is not None:
+                opti.subject_to(ca.cos(X[way_i[i], 2]) * ca.sin(self.headings[i]) - ca.sin(X[way_i[i], 2]) * ca.cos(self.headings[i]) == 0)
+            if 'theta_v' in node:
+                opti.subject_to(X[way_i[i], 5] == 0)
+
+        for i, node in enumerate(data['nodes']):
+            if not node.get('guess', False):
+                opti.subject_to(X[way_i[i], 0] == self.nodes[i, 0])
+                opti.subject_to(X[way_i[i], 1] == self.nodes[i, 1])
+
+        self.dts = []
+        T = 0
+
+        #per-step dt and percent, so every constraint family is added as one block over the horizon
+        dt_steps = []
+        percent_steps = []
+
+        for i in range(1, len(way_i)):
+            from_i = way_i[i - 1]
+            to_i = way_i[i]
+
+            self.dts.append(opti.variable())
+
+            opti.subject_to(self.dts[i-1] > 0)
+
+            T += self.dts[i-1] * (to_i - from_i)
+
+            dt_steps += [self.dts[i-1]] * (to_i - from_i)
+            percent_steps += [i] * (to_i - from_i)
+
+        dt_steps = ca.vertcat(*dt_steps)
+        steps = map_steps(X, U, dt_steps, self.robot, cfg, jit == True)
+
+        apply_dynamics_block(steps, opti)
+        apply_kinematics_block(steps, opti, cfg, self.percents[percent_steps])
+
+        self.obstacle_pairs = set()
+        self.obstacle_order = []
+
+        opti.minimize(T)
+
+        apply_kinematics2_block(steps, opti)
+
+        #options of the current ipopt instance, and the solution of the last solve
+        self.options = None
+        self.last = None
+
+    def set(self, data, cfg):
+        # parameter values for a path with this problem's structure, unused entries are left at 0
+        nodes = data['nodes']
+        opti = self.opti
+        def value(p, rows):
+            opti.set_value(p, np.array(rows, dtype=float))
+        value(self.nodes, [[node['x'], node['y']] for node in nodes])
+        value(self.headings, [node['theta'] if node['theta'] is not None else 0 for node in nodes])
+        value(self.velocities, [[node['vx'], node['vy'], node['vt']] if node['vx'] is not None and node['vy'] is not None else [0, 0, 0] for node in nodes])
+        value(self.percents, [node.get('percent', 1) for node in nodes])
+        if self.obstacles is not None:
+            value(self.obstacles, [[o['x'], o['y'], o['radius']] for o in data['obstacles']])
+        value(self.robot, [cfg.m, cfg.I])
+
+    def add_obstacles(self, pairs):
+        # constrains the pairs not constrained yet, returns how many that was
+        # pairs stay once added, a constraint against an obstacle that is far away is still true, just unneeded
+        missing = sorted(set(pairs) - self.obstacle_pairs)
+        apply_obstacles(self.X, missing, self.obstacles, self.opti, self.cfg)
+        self.obstacle_pairs |= set(missing)
+        self.obstacle_order += missing
+        return len(missing)
+
+    def solver(self, options, ipopt_options):
+        # a new ipopt instance only when the options change, with jit="nlp" that is a recompile
+        if self.options != (options, ipopt_options):
+            self.opti.solver("ipopt", options, ipopt_options)
+            self.options = (options, ipopt_options)
+
+
+#built problems by problem_key, least recently used first
+_problems = collections.OrderedDict()
+
+def get_problem(data, cfg, way_i, jit=False, size=4):
+    # the problem for this path's structure, built if none is kept, returns it and whether it was reused
+    # size is how many problems to keep, 0 builds a new one every time and drops any kept ones
+    if size <= 0:
+        _problems.clear()
+        return Problem(data, cfg, way_i, jit), False
+    key = problem_key(data, cfg, way_i, jit)
+    if key in _problems:
+        _problems.move_to_end(key)
+        return _problems[key], True
+    problem = Problem(data, cfg, way_i, jit)
+    _problems[key] = problem
+    while len(_problems) > size:
+        _problems.popitem(last=False)
+    return problem, False
+
+
+class Cancelled(Exception):
+    # raised when the caller gave up on the solve, not a RuntimeError so no retry picks it up
+    pass
+
+def optimize(data, cfg, way_i, init_dts, seed=None, warm_cache=None, key=None, on_iterate=None, iterate_every=1, cancelled=None):
+    # solves the nlp for one path over the given horizon, on a kept problem of the same structure when there is one
+    # starts from seed (a solution on any horizon over the same nodes), or else from the last solution of a kept problem,
+    # or else from the closest solution in warm_cache
+    # on_iterate, if given, is called with the iteration, X and dts of every iterate_every-th ipopt iterate
+    # cancelled, if given, is checked every ipopt iteration and stops the solve with Cancelled once it returns True
+    # returns the solution in the same form the warm start cache stores, plus stats of how the solve went
+    t = time.time()
+    stats = {'solve': 0, 'iterations': 0}
+
+    config = data['config']
+
+    w_x = [node['x'] for node in data['nodes']]
+    w_y = [node['y'] for node in data['nodes']]
+    w_theta = []
+
+    jit = config.get('jit', False) #True compiles the step function, "nlp" compiles the whole problem
+
+    N = int(way_i[-1]) #control points
+
+    #only parameters change between paths of the same structure, so the nlp is built once for all of them
+    problem, reused = get_problem(data, cfg, way_i, jit, config.get('problem_cache_size', 4))
+    if reused:
+        print(f"reusing the problem over {N} steps")
+    problem.set(data, cfg)
+    opti, X, U, dts = problem.opti, problem.X, problem.U, problem.dts
+
+    for node in data['nodes']:
+        if node['theta'] is not None:
+            w_theta.append(node['theta'])
+        else:
+            w_theta.append(w_theta[-1])
+
+    xSpace = []
+    ySpace = []
+    thetaSpace = []
+
+    w_theta = wrap_angles_to_least_delta(w_theta)
+
+    for j in range(1, len(way_i)):
+        from_i = way_i[j-1]
+        to_i = way_i[j]
+        for k in range(from_i, to_i):
+            interp = (k - from_i) / (to_i - from_i)
+            indexX = (1 - interp) * w_x[j-1] + interp * w_x[j]
+            indexY = (1 - interp) * w_y[j-1] + interp * w_y[j]
+
+
+            indexT = (1 - interp) * w_theta[j-1] + interp * w_theta[j]
+
+            xSpace.append(indexX)
+            ySpace.append(indexY)
+            thetaSpace.append(indexT)
+
+    xSpace.append(w_x[len(w_x) - 1])
+    ySpace.append(w_y[len(w_y) - 1])
+    thetaSpace.append(w_theta[len(w_theta) - 1])
+
+    def cold_start():
+        opti.set_initial(X, 0)
+        opti.set_initial(U, 0)
+        opti.set_initial(X[:, 0], xSpace)
+        opti.set_initial(X[:, 1], ySpace)
+        opti.set_initial(X[:, 2], thetaSpace)
+        for k in range(len(dts)):
+            opti.set_initial(dts[k], init_dts[k])
+
+    cold_start()
+
+    ######### WARM START ###########
+    #with warm_start the last solve of a kept problem is the latest edit of this path, otherwise previous solutions
+    #are kept on disk and the one with the nearest nodes seeds this solve
+    warm = seed
+    source = "seed"
+    if warm is None and problem.last is not None and config.get('warm_start', False):
+        warm = problem.last
+        source = "last solution"
+    if warm is None and warm_cache is not None:
+        warm = warmstart.closest(warm_cache, data)
+        source = "cached solution"
+
+    #Value constraints
+    #with a margin only obstacles within reach of the initial guess get constraints, the solution is re-checked against all of them
+    obstacle_margin = config.get('obstacle_margin', None) #None constrains every obstacle at every point
+    obstacle_passes = config.get('obstacle_passes', 3)
+    all_pairs = set((i, o) for i in range(N+1) for o in range(len(data['obstacles'])))
+
+    if obstacle_margin is None:
+        obstacle_pairs = all_pairs
+        obstacle_grid = None
+    else:
+        obx = [obstacle['x'] for obstacle in data['obstacles']]
+        oby = [obstacle['y'] for obstacle in data['obstacles']]
+        obr = [obstacle['radius'] for obstacle in data['obstacles']]
+        obstacle_reach = corner_reach(cfg) + obstacle_margin
+        obstacle_grid = ObstacleGrid(obx, oby, obr, obstacle_reach)
+        obstacle_pairs = set(obstacle_grid.pairs(xSpace, ySpace, obstacle_reach))
+        if warm is not None and warm['way_i'] == way_i.tolist():
+            #start from what the seeding solve ended up constraining
+            obstacle_pairs |= set((i, o) for i, o in warm['obstacle_order'] if o < len(obx))
+    #a kept problem keeps the pairs of its earlier paths as well
+    problem.add_obstacles(obstacle_pairs)
+
+    solver_options = {}
+    if jit == "nlp":
+        #compile the whole nlp and its derivatives to C instead of just the step
+        solver_options = JIT_OPTIONS
+
+    ipopt_options = {"mu_init": 1e-6}
+    if warm is not None:
+        #only the primal guess is seeded, duals of another problem strand ipopt
+        #and a seed that does not pay off quickly is given up for the cold solve
+        print("warm starting from " + source)
+        warmstart.seed(opti, X, U, dts, way_i, warm)
+        problem.solver(solver_options, {**ipopt_options,
+                                        "max_iter": config.get('warm_max_iter', 100),
+                                        "max_cpu_time": config.get('warm_max_time', 5.0)})
+    else:
+        problem.solver(solver_options, ipopt_options)
+    if warm is not None or reused:
+        opti.set_initial(opti.lam_g, 0)
+
+    #for instrumenting the callback only stamps the time, the values of each iteration come from ipopt's own stats afterwards
+    instrument = config.get('instrument', False)
+    iteration_times = []
+    if instrument:
+        stats['solves'] = []
+
+    def iteration(i):
+        if cancelled is not None and cancelled():
+            #ipopt stops on any exception from the callback
+            raise Cancelled()
+        if instrument:
+            iteration_times.append(time.time())
+        if on_iterate is not None and i % iterate_every == 0:
+            on_iterate(i, opti.debug.value(X), [float(opti.debug.value(dt)) for dt in dts])
+
+    #a kept problem still holds the callback of its last solve
+    opti.callback(iteration if instrument or on_iterate is not None or cancelled is not None else None)
+
+    def timed_solve():
+        t = time.time()
+        try:
+            return opti.solve()
+        except RuntimeError:
+            if cancelled is not None and cancelled():
+                raise Cancelled("solve cancelled")
+            raise
+        finally:
+            stats['solve'] += time.time() - t
+            ipopt = opti.stats()
+            stats['iterations'] += ipopt.get('iter_count', 0)
+            if instrument:
+                trace = ipopt.get('iterations', {})
+                stats['solves'].append({
+                    'steps': N,
+                    'warm': warm is not None,
+                    'reused': reused,
+                    'status': ipopt.get('return_status'),
+                    'time': time.time() - t,
+                    'iterations': ipopt.get('iter_count', 0),
+                    'constraints': opti.ng,
+                    #wall time inside each nlp function, the rest of the solve is ipopt itself
+                    'nlp_time': {k[len('t_wall_nlp_'):]: v for k, v in ipopt.items() if k.startswith('t_wall_nlp_')},
+                    'trace': [{'t': iteration_times[i] - t if i < len(iteration_times) else None,
+                               **{k: trace[k][i] for k in TRACE_KEYS if k in trace}}
+                              for i in range(len(trace.get('obj', [])))],
+                })
+                iteration_times.clear()
+
+    def cold_solve():
+        cold_start()
+        opti.set_initial(opti.lam_g, 0)
+        problem.solver(solver_options, ipopt_options)
+        return timed_solve()
+
+    def unpruned_solve(reason):
+        #pruning left out a constraint the solve needed, so it starts over with every obstacle at every point
+        #on a new problem rather than the pruned one, so it is the same nlp as solving without a margin
+        nonlocal problem, reused, warm, opti, X, U, dts
+        print(f"{reason}, resolving with every obstacle constrained")
+        _problems.pop(problem_key(data, cfg, way_i, jit), None)
+        problem, reused = get_problem(data, cfg, way_i, jit, config.get('problem_cache_size', 4))
+        problem.set(data, cfg)
+        opti, X, U, dts = problem.opti, problem.X, problem.U, problem.dts
+        problem.add_obstacles(all_pairs)
+        opti.callback(iteration if instrument or on_iterate is not None or cancelled is not None else None)
+        warm = None
+        return cold_solve()
+
+    for p in range(max(1, obstacle_passes)):
+        try:
+            try:
+                sol = timed_solve()
+            except RuntimeError:
+                if warm is None or p > 0:
+                    raise
+                #a bad seed can strand ipopt, the plain initial guess gets its own try
+                print("warm started solve failed, solving from the initial guess")
+                warm = None
+                sol = cold_solve()
+        except RuntimeError:
+            if obstacle_grid is None or len(problem.obstacle_pairs) == len(all_pairs):
+                raise
+            sol = unpruned_solve("pruned solve failed")
+            break
+        if obstacle_grid is None:
+            break
+        path = [sol.value(X[:, k]) for k in range(3)]
+        if len(set(obstacle_grid.violations(*path, cfg)) - problem.obstacle_pairs) == 0:
+            break
+        if p + 1 >= obstacle_passes:
+            sol = unpruned_solve("obstacles still clipped after the last pass")
+            break
+        #the solution left the region the pairs were picked from, constrain everything near it and resolve
+        missing = problem.add_obstacles(obstacle_grid.pairs(path[0], path[1], obstacle_reach))
+        print(f"resolving with {missing} more obstacle constraints")
+        opti.set_initial(sol.value_variables())
+        #later passes start from a solution, not from the seed, so they are not capped
+        problem.solver(solver_options, ipopt_options)
+
+    solution = {
+        'way_i': list(map(int, way_i)),
+        'obstacle_order': [list(map(int, p)) for p in problem.obstacle_order],
+        'X': sol.value(X),
+        'U': sol.value(U),
+        'dts': [float(sol.value(dt)) for dt in dts],
+        #everything that was not ipopt counts as building, including the constraints added between passes
+        'stats': {**stats, 'build': time.time() - t - stats['solve'], 'variables': opti.nx, 'constraints': opti.ng},
+    }
+    problem.last = solution
+    if warm_cache is not None and key is not None:
+        warmstart.store(warm_cache, key, data, solution)
+
+    return solution
@@ -1,206 +1,233 @@
 import json
-import casadi as ca
-import numpy as np
-from system import apply_dynamics, apply_kinematics, apply_kinematics2
-import math
-from constants import *
-import constants
-from motor import *
-import motor
-from util import *
-
-######### READ FILE ###########
-with open('data.in', 'r') as file:
-    data = json.load(file)
-
-obx = [obstacle['x'] for obstacle in data['obstacles']]
-oby = [obstacle['y'] for obstacle in data['obstacles']]
-obr = [obstacle['radius'] for obstacle in data['obstacles']]
-
-w_x = [node['x'] for node in data['nodes']]
-w_y = [node['y'] for node in data['nodes']]
-w_theta = []
-
-ct = 25
-
-config = data['config']
-map_w = config['map_w']
-map_h = config['map_h']
-
-N = ct * len(w_x) - ct #control points
-
-opti = ca.Opti()
-
-T = 0
-
-x_n = 6 #state vars [x, y, theta, x_dot, y_dot, theta_dot]
-u_n = 8 #input vars [F1x, F2x, F3x, F4x, F1y, F2y, F3y, F4y]
-X = opti.variable(N+1, x_n)
-U = opti.variable(N+1, u_n)
-
-def override_velo(i, vx, vy, vt):
-    opti.subject_to(X[i, 3] == vx)
-    opti.subject_to(X[i, 4] == vy)
-    opti.subject_to(X[i, 5] == vt)
-
-way_i = np.linspace(0, N, len(w_x))
-way_i = way_i.astype(int)
-
-percents = []
-
-guess = []
-
-i = 0
-for node in data['nodes']:
-    if node['vx'] is not None and node['vy'] is not None:
-        override_velo(i * ct, node['vx'], node['vy'], node['vt'])
-    if node['theta'] is not None:
-        opti.subject_to(ca.cos(X[way_i[i], 2]) * math.sin(node['theta']) - ca.sin(X[way_i[i], 2]) * math.cos(node['theta']) == 0)
-        w_theta.append(node['theta'])
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+def add_stats(stats, solution):
+    for k in ('build', 'solve', 'iterations'):
+        stats[k] = stats.get(k, 0) + solution['stats'][k]
+    for k in ('variables', 'constraints'):
+        stats[k] = solution['stats'][k]
+    if 'solves' in solution['stats']:
+        stats['solves'] = stats.get('solves', []) + solution['stats']['solves']
+
+def to_states(split):
+    return [{'x': s[0], 'y': s[1], 'theta': s[2], 'vx': s[3], 'vy': s[4]} for s in split.tolist()]
+
+def open_stream(stream):
+    # where intermediate iterates are written, true for stdout or a file name, None when not streaming
+    # returns emit, which writes one object as a json line, and close, or None, None
+    if stream is None or stream is False:
+        return None, None
+    if stream is True or stream == "stdout":
+        #the stream keeps the real stdout, whatever ipopt and the solver print goes to stderr until it closes
+        sys.stdout.flush()
+        out = os.fdopen(os.dup(1), 'w')
+        saved = os.dup(1)
+        os.dup2(2, 1)
+        def close():
+            out.close()
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
     else:
-        w_theta.append(w_theta[-1])
-
-    if 'guess' in node and node['guess']:
-        guess.append(True)
-    else:
-        guess.append(False)
-
-    if 'theta_v' in node:
-        opti.subject_to(X[way_i[i], 5] == 0)
-
-    if 'percent' in node:
-        percents.append(node['percent'])
-    else:
-        percents.append(1)
-    i+=1
-
-
-#Value constraints
-for i in range(N+1):
-    for o in range(len(obx)):
-        c = corners(X[i, 2])
-        x = X[i, 0]
-        y = X[i, 1]
-
-        opti.subject_to((X[i, 0] + c[0][0] - obx[o])**2 + (X[i, 1] + c[0][1] - oby[o])**2 > obr[o]**2)
-        opti.subject_to((X[i, 0] + c[1][0] - obx[o])**2 + (X[i, 1] + c[1][1] - oby[o])**2 > obr[o]**2)
-        opti.subject_to((X[i, 0] + c[2][0] - obx[o])**2 + (X[i, 1] + c[2][1] - oby[o])**2 > obr[o]**2)
-        opti.subject_to((X[i, 0] + c[3][0] - obx[o])**2 + (X[i, 1] + c[3][1] - oby[o])**2 > obr[o]**2)
-
-for i in range(0, len(w_x)):
-    if not guess[i]:
-        opti.subject_to(X[way_i[i], 0] == w_x[i])
-        opti.subject_to(X[way_i[i], 1] == w_y[i])
-
-dts = []
-initDt = 4.95/ct
-
-for i in range(1, len(way_i)):
-    from_i = way_i[i - 1]
-    to_i = way_i[i]
-    percent = percents[i]
-
-    dts.append(opti.variable())
-
-    opti.subject_to(dts[i-1] > 0)
-    opti.set_initial(dts[i-1], initDt)
-
-    T += dts[i-1] * (to_i - from_i)
-
-    for j in range(from_i, to_i):
-        apply_dynamics(X, U, dts[i-1], j, opti)
-        apply_kinematics(X, U, dts[i-1], j, opti, percent)
-
-
-xSpace = []
-ySpace = []
-thetaSpace = []
-vxSpace = []
-vySpace = []
-wSpace = []
-
-def shortest_angle_lerp(a, b, t):
-    result = ((b - a) + 180) % 360 - 180
-    return a + result * t
-
-
-def wrap_angles_to_least_delta(angles):
-    wrapped_angles = np.zeros_like(angles)
-    wrapped_angles[0] = angles[0]
-
-    for i in range(1, len(angles)):
-        delta = angles[i] - wrapped_angles[i - 1]
-        # Wrap the delta to be within [-π, π] range
-        delta = (delta + np.pi) % (2 * np.pi) - np.pi
-        wrapped_angles[i] = wrapped_angles[i - 1] + delta
-
-    return wrapped_angles
-
-w_theta = wrap_angles_to_least_delta(w_theta)
-
-# for i in range(0, len(w_theta) - 1):
-#    w_theta[i+1] = w_theta[i] + ((w_theta[i+1] - w_theta[i]) + 180) % 360 - 180
-
-
-for j in range(1, len(way_i)):
-    from_i = way_i[j-1]
-    to_i = way_i[j]
-    for k in range(from_i, to_i):
-        interp = (k - from_i) / (to_i - from_i)
-        indexX = (1 - interp) * w_x[j-1] + interp * w_x[j]
-        indexY = (1 - interp) * w_y[j-1] + interp * w_y[j]
-
-
-        indexT = (1 - interp) * w_theta[j-1] + interp * w_theta[j]
-        # indexT = shortest_angle_lerp(w_theta[j-1], w_theta[j], interp)
-        # indexT = (indexT + 720) % 360
-
-
-        xSpace.append(indexX)
-        ySpace.append(indexY)
-        thetaSpace.append(indexT)
-
-xSpace.append(w_x[len(w_x) - 1])
-ySpace.append(w_y[len(w_y) - 1])
-thetaSpace.append(w_theta[len(w_theta) - 1])
-
-opti.set_initial(X[:, 0], xSpace)
-opti.set_initial(X[:, 1], ySpace)
-opti.set_initial(X[:, 2], thetaSpace)
-
-opti.minimize(T)
-opti.solver("ipopt", {},  {"mu_init": 1e-6})
-
-for i in range(1, len(way_i)):
-    from_i = way_i[i-1]
-    to_i = way_i[i]
-    for j in range(from_i, to_i):
-        apply_kinematics2(X, U, dts[i-1], j, opti)
-
-sol = opti.solve()
-
-timestamp = [0]
-
-for i in range(1, len(way_i)):
-    for j in range(way_i[i-1], way_i[i]):
-        timestamp.append(timestamp[len(timestamp) - 1] + sol.value(dts[i-1]))
-
-x = sol.value(X[:, 0])
-y = sol.value(X[:, 1])
-theta = sol.value(X[:, 2])
-
-dtt = []
-for i in range(len(dts)):
-    dtt.append(sol.value(dts[i]))
-
-split = split_even_dt(dtt, way_i, x, y, theta)
-split_velo = split_even_dt(dtt, way_i, sol.value(X[:, 3]), sol.value(X[:, 4]), sol.value(X[:, 5]))
-
-def create_json(dt, x, y, theta, xd, yd):
-    states = [{'x': x[i], 'y': y[i], 'theta': theta[i], 'vx': xd[i], 'vy': yd[i]} for i in range(len(x))]
-    result = {'dt': dt, 'state': states}
-
+        out = open(stream, 'w')
+        close = out.close
+    def emit(obj):
+        out.write(json.dumps(obj) + "\n")
+        out.flush()
+    return emit, close
+
+def stream_iterates(emit, way_i, output_dt, stage):
+    # on_iterate for optimize, emits each iterate resampled to output_dt
+    from util import resample
+    def on_iterate(i, X, dts):
+        #dt > 0 is a constraint rather than a bound, an iterate can break it on the way
+        split = resample([max(dt, 1e-3) for dt in dts], way_i, X, output_dt, angles=(2,))
+        emit({'stage': stage, 'iteration': i, 'dt': output_dt, 'state': to_states(split)})
+    return on_iterate
+
+def solve(data, stats=None, emit=None, cancelled=None):
+    # solves one path given the contents of data.in, returns the contents of data.out
+    # stats, if given, gets the time spent building, solving and resampling, and the ipopt iterations, summed over every solve
+    # emit, if given, gets the streamed objects instead of the stream the config names, the daemon sends them back this way
+    # cancelled, if given, is checked while ipopt runs, the daemon uses it to stop once its client is gone
+    # imported here so handing the request to a daemon never pays for casadi
+    from cache import open_cache, digest, source_digest
+    from constants import Config
+    from problem import horizon, coarsen, optimize
+    from util import resample
+
+    config = data['config']
+
+    cfg = Config(config)
+    stats = {} if stats is None else stats
+    output_dt = config.get('output_dt', 0.02)
+
+    #intermediate iterates go out as json lines while ipopt runs, so progress can be drawn before the solve ends
+    close = None
+    if emit is None:
+        emit, close = open_stream(config.get('stream'))
+    stream_every = max(1, int(config.get('stream_every', 5)))
+    def streaming(way_i, stage):
+        return stream_iterates(emit, way_i, output_dt, stage) if emit is not None else None
+    def end_stream(result):
+        if emit is not None:
+            emit({'stage': "final", 'iteration': stats.get('iterations', 0), **result})
+
+    try:
+        ######### RESULT CACHE ###########
+        #identical inputs to the same solver give back the stored data.out without solving
+        key = digest(data)
+        result_key = digest([source_digest(), data])
+        result_cache = open_cache("results", config.get('result_cache_size', 64)) if config.get('result_cache', True) else None
+        if result_cache is not None:
+            result = result_cache.get(result_key)
+            if result is not None:
+                print(f"result cache hit ({result_cache.report()})")
+                stats['result_cache'] = True
+                end_stream(result)
+                return result
+            print(f"result cache miss ({result_cache.report()})")
+
+        warm_cache = open_cache("warm", config.get('warm_cache_size', 32)) if config.get('warm_start', False) else None
+
+        way_i, init_dts = horizon(data, cfg)
+
+        seed = None
+        if config.get('coarse_to_fine', False):
+            #a solve on a sparser horizon is cheap and lands close, the full horizon then starts from it
+            coarse_i, coarse_dts = coarsen(way_i, init_dts, config.get('coarse_factor', 0.3))
+            print(f"coarse solve over {coarse_i[-1]} steps")
+            try:
+                seed = optimize(data, cfg, coarse_i, coarse_dts, warm_cache=warm_cache,
+                                on_iterate=streaming(coarse_i, "coarse"), iterate_every=stream_every, cancelled=cancelled)
+                add_stats(stats, seed)
+            except RuntimeError:
+                #the coarse solve is only a seed, the full horizon still gets its usual start
+                print("coarse solve failed, solving the full horizon without it")
+
+        solution = optimize(data, cfg, way_i, init_dts, seed, warm_cache, key,
+                            on_iterate=streaming(way_i, "full"), iterate_every=stream_every, cancelled=cancelled)
+        add_stats(stats, solution)
+
+        #pose and velocity go through one resample, theta the short way round
+        t = time.time()
+        split = resample(solution['dts'], way_i, solution['X'], output_dt, angles=(2,))
+        stats['resample'] = time.time() - t
+
+        result = {'dt': output_dt, 'state': to_states(split)}
+        end_stream(result)
+    finally:
+        if close is not None:
+            close()
+
+    if result_cache is not None:
+        result_cache.put(result_key, result)
+
+    return result
+
+
+######### DAEMON ###########
+#a resident daemon.py keeps imports and compiled functions warm, this script hands requests to it when one is up
+DAEMON_FILE = os.path.join(os.path.split(os.path.abspath(__file__))[0], "daemon.json")
+
+def request(data, timeout=None, stats=None, emit=None):
+    # sends one solve request to a running daemon, None when there is no daemon to talk to
+    # raises TimeoutError when the daemon sends nothing for timeout seconds, closing the connection stops its solve
+    # stats, if given, gets the stats of the solve in the daemon
+    # emit, if given, gets the iterates the daemon streams back before its reply
+    try:
+        with open(DAEMON_FILE, 'r') as file:
+            port = json.load(file)['port']
+        conn = socket.create_connection(("127.0.0.1", port), timeout=1)
+    except (OSError, ValueError, KeyError):
+        return None
+    reply = None
+    with conn:
+        conn.settimeout(timeout)
+        conn.sendall((json.dumps({'id': 0, 'data': data}) + "\n").encode("utf-8"))
+        for line in conn.makefile('r'):
+            reply = json.loads(line)
+            if 'iterate' not in reply:
+                break
+            if emit is not None:
+                emit(reply['iterate'])
+            reply = None
+    if reply is None:
+        return None
+    if stats is not None:
+        stats.update(reply.get('stats', {}))
+    if not reply['ok']:
+        raise RuntimeError(reply['error'])
+    return reply['result']
+
+def spawn_daemon(wait=10):
+    # starts a daemon in the background for later solves, returns once it is accepting requests
+    root = os.path.split(os.path.abspath(__file__))[0]
+    subprocess.Popen([sys.executable, os.path.join(root, "daemon.py"), "--port", "0"],
+                     cwd=root, start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    t = time.time()
+    while time.time() - t < wait:
+        if os.path.exists(DAEMON_FILE):
+            return True
+        time.sleep(0.1)
+    return False
+
+def create_json(result):
     with open('data.out', 'w') as f:
         json.dump(result, f, indent=4)
 
-create_json(0.02, split[0][:], split[1][:], split[2][:], split_velo[0][:], split_velo[1][:])
+def write_stats(path, stats):
+    # the instrument sidecar, written beside the output it describes
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=4)
+
+def main():
+    t = time.time()
+
+    ######### READ FILE ###########
+    with open('data.in', 'r') as file:
+        data = json.load(file)
+
+    stats = {'parse': time.time() - t}
+    instrument = data['config'].get('instrument', False)
+
+    #opened here rather than in solve, so a solve in the daemon streams back to this script's stdout or file
+    emit, close = open_stream(data['config'].get('stream'))
+    try:
+        #a daemon that is busy with another solve or stuck does not hold this one up for longer than daemon_timeout
+        timeout = data['config'].get('daemon_timeout', 60)
+        try:
+            result = request(data, timeout, stats, emit)
+            if result is None and data['config'].get('daemon', False) and spawn_daemon():
+                result = request(data, timeout, stats, emit)
+        except TimeoutError:
+            print("daemon did not reply in time, solving here")
+            result = None
+        if result is None:
+            result = solve(data, stats, emit)
+        else:
+            print("solved by daemon")
+            stats['daemon'] = True
+    except Exception as e:
+        if instrument:
+            write_stats('data.stats', {**stats, 'ok': False, 'error': f"{type(e).__name__}: {e}", 'total': time.time() - t})
+        raise
+    finally:
+        if close is not None:
+            close()
+
+    w = time.time()
+    create_json(result)
+    stats['write'] = time.time() - w
+
+    if instrument:
+        write_stats('data.stats', {**stats, 'ok': True, 'total': time.time() - t})
+
+if __name__ == "__main__":
+    main()
@@ -1,125 +1,125 @@
 import casadi as ca
-import math
 import numpy as np
-import matplotlib.pyplot as plt
-from constants import m, l, I
-import constants as cs
-from motor import get_current, get_torque
-from util import corners
-
-def apply_dynamics(X, U, dt, i, opti):
-    #X = [x, y, t, x_d, y_d, t_d]
-    # 
-    #   ^ +y
-    #   |
-    # F1--F2
-    # |    | ---> +x
-    # F3--F4
-    Fx = U[i, :4]
-    Fy = U[i, 4:]
-
-    theta = X[i, 2]
-
-    c = corners(theta)
-
-    torque1 = c[0][1] * Fy[0] - c[0][0] * Fx[0]
-    torque2 = c[1][1] * Fy[1] - c[1][0] * Fx[1]
-    torque3 = c[2][1] * Fy[2] - c[2][0] * Fx[2]
-    torque4 = c[3][1] * Fy[3] - c[3][0] * Fx[3]
-
-    atT = (torque1 + torque2 + torque3 + torque4) / I
-
-    axG = (Fx[0] + Fx[1] + Fx[2] + Fx[3]) / m
-    ayG = (Fy[0] + Fy[1] + Fy[2] + Fy[3]) / m
-
-    opti.subject_to(X[i+1, 0] == X[i, 0] + X[i, 3] * dt + 0.5 * axG * dt * dt)
-    opti.subject_to(X[i+1, 1] == X[i, 1] + X[i, 4] * dt + 0.5 * ayG * dt * dt)
-    opti.subject_to(X[i+1, 2] == X[i, 2] + X[i, 5] * dt + 0.5 * atT * dt * dt)
-
-    opti.subject_to(X[i+1, 3] == X[i, 3] + axG * dt)
-    opti.subject_to(X[i+1, 4] == X[i, 4] + ayG * dt)
-    opti.subject_to(X[i+1, 5] == X[i, 5] + atT * dt)
-
-
-m_dx = [-l * math.sqrt(2), l * math.sqrt(2), -l * math.sqrt(2), l * math.sqrt(2)]
-m_dy = [l * math.sqrt(2), l * math.sqrt(2), -l * math.sqrt(2), -l * math.sqrt(2)]
-
-def apply_kinematics(X, U, dt, i, opti, percent=1):
-
-    cosi = ca.cos(X[i+1, 2]) - ca.cos(X[i, 2]) #DONE TWICE BECAUSE REPEATED METHOD
-    sini = ca.sin(X[i, 2]) - ca.sin(X[i+1, 2])
-    xi1 = X[i+1, 0] - X[i, 0]
-    xi2 = X[i+1, 1] - X[i, 1]
-
-    for mo in range(4):
-        # dx0 = m_dx[mo] * ca.cos(X[i, 2]) - m_dy[mo] * ca.sin(X[i, 2])
-        # dy0 = m_dy[mo] * ca.cos(X[i, 2]) + m_dx[mo] * ca.sin(X[i, 2])
-
-        # dx1 = m_dx[mo] * ca.cos(X[i+1, 2]) - m_dy[mo] * ca.sin(X[i+1, 2])
-        # dy1 = m_dy[mo] * ca.cos(X[i+1, 2]) + m_dx[mo] * ca.sin(X[i+1, 2])
-
-        # x0 = X[i, 0] + dx0
-        # y0 = X[i, 1] + dy0
-
-        # x1 = X[i+1, 0] + dx1
-        # y1 = X[i+1, 1] + dy1
-
-        # vx = (x1 - x0) / dt
-        # vy = (y1 - y0) / dt
-
-        vx = (m_dx[mo] * (cosi) + m_dy[mo] * (sini) + xi1) / dt
-        vy = (m_dy[mo] * (cosi) + m_dx[mo] * (sini) + xi2) / dt
-
-        v = vx**2 + vy**2
-
-        opti.subject_to(v < (cs.max_module_ground_speed * cs.free_speed_percent * percent) ** 2)
-
-        c = get_current(ca.sqrt(v) / cs.wheel_radius, 12)
-        t = get_torque(c)
-        tm = get_torque(70)
-        f = t / cs.wheel_radius
-        fm = tm / cs.wheel_radius
-
-        opti.subject_to(opti.bounded(-(fm**2), U[i, mo]**2 + U[i, mo + 4]**2, fm**2))
-
-
-
-def apply_kinematics2(X, U, dt, i, opti):
-
-    cosi = ca.cos(X[i+1, 2]) - ca.cos(X[i, 2])
-    sini = ca.sin(X[i, 2]) - ca.sin(X[i+1, 2])
-    xi1 = X[i+1, 0] - X[i, 0]
-    xi2 = X[i+1, 1] - X[i, 1]
-
-    for mo in range(4):
-        #dx0 = m_dx[mo] * ca.cos(X[i, 2]) - m_dy[mo] * ca.sin(X[i, 2])
-        #dy0 = m_dy[mo] * ca.cos(X[i, 2]) + m_dx[mo] * ca.sin(X[i, 2])
-
-        #dx1 = m_dx[mo] * ca.cos(X[i+1, 2]) - m_dy[mo] * ca.sin(X[i+1, 2])
-        #dy1 = m_dy[mo] * ca.cos(X[i+1, 2]) + m_dx[mo] * ca.sin(X[i+1, 2])
-
-        # m_dx[mo] * ca.cos(X[i+1, 2]) - m_dy[mo] * ca.sin(X[i+1, 2]) - m_dx[mo] * ca.cos(X[i, 2]) + m_dy[mo] * ca.sin(X[i, 2]) + X[i+1, 0] - X[i, 0]
-        #
-        # m_dx[mo] * [ca.cos(X[i+1, 2]) - ca.cos(X[i, 2])] + m_dy[mo] * [ca.sin(X[i, 2]) - ca.sin(X[i+1, 2])] + X[i+1, 0] - X[i, 0]
-
-        #x0 = X[i, 0] + dx0
-        #y0 = X[i, 1] + dy0
-
-        #x1 = X[i+1, 0] + dx1
-        #y1 = X[i+1, 1] + dy1
-
-        vx = (m_dx[mo] * (cosi) + m_dy[mo] * (sini) + xi1) / dt
-        vy = (m_dy[mo] * (cosi) + m_dx[mo] * (sini) + xi2) / dt
-        #vy = (y1 - y0) / dt
-
-        v = vx**2 + vy**2
-
-        # opti.subject_to(v < cs.max_module_ground_speed ** 2)
-
-        c = get_current(ca.sqrt(v) / cs.wheel_radius, 12)
-        t = get_torque(c)
-        f = t / cs.wheel_radius
-
-        opti.subject_to(opti.bounded(-(f**2), U[i, mo]**2 + U[i, mo + 4]**2, f**2))
-
-        #opti.subject_to(U[i, mo]**2 + U[i, mo + 4]**2 < f**2)
\ No newline at end of file
+from util import corners, corner_offsets
+
+def module_offsets(cfg):
+    # module positions relative to the robot center, as x offsets and y offsets
+    return [x for x, _ in corner_offsets(cfg)], [y for _, y in corner_offsets(cfg)]
+
+JIT_OPTIONS = {"jit": True, "compiler": "shell", "jit_options": {"flags": ["-O1"], "verbose": False}}
+
+_step = {}
+
+def step_function(cfg, jit=False):
+    # one step of the swerve model over (X_i, X_{i+1}, U_i, dt, [mass, inertia])
+    # traced once, then mapped over the horizon so the nlp holds a single call node instead of N copies
+    # with jit, the step and its derivatives are compiled to C (needs a compiler on the path)
+    # kept per set of robot constants, so a long running solver reuses it across paths of the same robot
+    # mass and inertia are inputs rather than constants, so a problem can take them as parameters
+    key = (not not jit, cfg.key)
+    if key in _step:
+        return _step[key]
+
+    m_dx, m_dy = module_offsets(cfg)
+
+    x0 = ca.SX.sym("x0", 6)
+    x1 = ca.SX.sym("x1", 6)
+    u = ca.SX.sym("u", 8)
+    dt = ca.SX.sym("dt")
+    robot = ca.SX.sym("robot", 2)
+
+    Fx = u[:4]
+    Fy = u[4:]
+
+    c = corners(x0[2], cfg)
+
+    atT = (c[0][1] * Fy[0] - c[0][0] * Fx[0] +
+           c[1][1] * Fy[1] - c[1][0] * Fx[1] +
+           c[2][1] * Fy[2] - c[2][0] * Fx[2] +
+           c[3][1] * Fy[3] - c[3][0] * Fx[3]) / robot[1]
+
+    axG = ca.sum1(Fx) / robot[0]
+    ayG = ca.sum1(Fy) / robot[0]
+
+    predicted = ca.vertcat(
+        x0[0] + x0[3] * dt + 0.5 * axG * dt * dt,
+        x0[1] + x0[4] * dt + 0.5 * ayG * dt * dt,
+        x0[2] + x0[5] * dt + 0.5 * atT * dt * dt,
+        x0[3] + axG * dt,
+        x0[4] + ayG * dt,
+        x0[5] + atT * dt,
+    )
+
+    cosi = ca.cos(x1[2]) - ca.cos(x0[2])
+    sini = ca.sin(x0[2]) - ca.sin(x1[2])
+    xi1 = x1[0] - x0[0]
+    xi2 = x1[1] - x0[1]
+
+    vx = (ca.DM(m_dx) * cosi + ca.DM(m_dy) * sini + xi1) / dt
+    vy = (ca.DM(m_dy) * cosi + ca.DM(m_dx) * sini + xi2) / dt
+
+    v = vx**2 + vy**2
+
+    c = cfg.motor.get_current(ca.sqrt(v) / cfg.wheel_radius, 12)
+    t = cfg.motor.get_torque(c)
+    f = t / cfg.wheel_radius
+
+    _step[key] = ca.Function(
+        "step",
+        [x0, x1, u, dt, robot],
+        [x1 - predicted, v, Fx**2 + Fy**2, f**2],
+        ["x0", "x1", "u", "dt", "robot"],
+        ["dynamics", "speed", "force", "force_max"],
+        JIT_OPTIONS if jit else {},
+    )
+    return _step[key]
+
+def map_steps(X, U, dt, robot, cfg, jit=False):
+    # evaluates step_function over every step of the horizon, one column per step
+    # dt is a column with one entry per step, robot is [mass, inertia] for every step
+    N = X.shape[0] - 1
+    return step_function(cfg, jit).map(N)(X[:-1, :].T, X[1:, :].T, U[:-1, :].T, dt.T, robot)
+
+# the block constraints below are grouped by kind, every step's dynamics, then every step's speeds, and so on
+# the original step by step formulation interleaved them per step, which is the same nlp with its rows in another order
+# ipopt's path depends on that order, so a path can come out differently where the problem has more than one local optimum
+
+def apply_dynamics_block(steps, opti):
+    # x_{i+1} follows from x_i, u_i and dt under constant acceleration, for every step at once
+    dynamics, _, _, _ = steps
+
+    opti.subject_to(ca.vec(dynamics) == 0)
+
+def apply_kinematics_block(steps, opti, cfg, percent=1):
+    # keeps every module under its ground speed and force limits, for every step at once
+    # percent is either a scalar, an array with one entry per step or a column of parameters with one entry per step
+    _, v, force, _ = steps
+    fm = cfg.motor.get_torque(70) / cfg.wheel_radius
+
+    if not isinstance(percent, ca.MX):
+        percent = ca.DM(np.broadcast_to(np.asarray(percent, dtype=float), (v.shape[1],)))
+    limit = (cfg.max_module_ground_speed * cfg.free_speed_percent * percent) ** 2
+    #every module of a step shares its limit
+    opti.subject_to(ca.vec(v) < ca.vec(ca.repmat(limit.T, 4, 1)))
+
+    opti.subject_to(opti.bounded(-(fm**2), ca.vec(force), fm**2))
+
+def apply_kinematics2_block(steps, opti):
+    # keeps every module's force within what its motor gives at the module's speed, for every step at once
+    _, _, force, force_max = steps
+
+    opti.subject_to(opti.bounded(-ca.vec(force_max), ca.vec(force), ca.vec(force_max)))
+
+def apply_obstacles(X, pairs, obstacles, opti, cfg):
+    # keeps every corner of the robot outside the obstacle, for each (control index, obstacle) pair at once
+    # obstacles has a row of x, y and radius per obstacle, as numbers or parameters
+    if len(pairs) == 0:
+        return
+    idx = [i for i, _ in pairs]
+    o = [o for _, o in pairs]
+    ox = obstacles[o, 0]
+    oy = obstacles[o, 1]
+    r2 = obstacles[o, 2]**2
+
+    for cx, cy in corners(X[idx, 2], cfg):
+        opti.subject_to((X[idx, 0] + cx - ox)**2 + (X[idx, 1] + cy - oy)**2 > r2)
@@ -1,15 +1,23 @@
-from constants import l
 import casadi as ca
 import math
+import numpy as np
 
-def corners(theta):
+def corner_offsets(cfg):
+    l = cfg.l
+    return [(-l*math.sqrt(2), l*math.sqrt(2)),
+            (l*math.sqrt(2), l*math.sqrt(2)),
+            (-l*math.sqrt(2), -l*math.sqrt(2)),
+            (l*math.sqrt(2), -l*math.sqrt(2))]
+
+def corner_reach(cfg):
+    # distance from the robot center to its furthest corner
+    return max(math.hypot(x, y) for x, y in corner_offsets(cfg))
+
+def corners(theta, cfg):
     c = ca.cos(theta)
     s = ca.sin(theta)
 
-    return [rotate(-l*math.sqrt(2), l*math.sqrt(2), c, s),
-            rotate(l*math.sqrt(2), l*math.sqrt(2),  c, s),
-            rotate(-l*math.sqrt(2), -l*math.sqrt(2), c, s),
-            rotate(l*math.sqrt(2), -l*math.sqrt(2), c, s)]
+    return [rotate(x, y, c, s) for x, y in corner_offsets(cfg)]
 
 def rotate(x, y, c, s):
     return [x * c - y * s, y * c + x * s]
@@ -18,31 +26,34 @@ def interpolate(t0, t1, t2, a, b):
     w = (t1 - t0) / (t2 - t0)
     return a * (1 -w) + b * (w)
 
-def split_even_dt(dts, way_i, x, y, theta):
-    timestamp = [0]
-    for i in range(1, len(way_i)):
-        from_i = way_i[i - 1]
-        to_i = way_i[i]
-        dt_seg = dts[i-1]
-        for j in range(from_i, to_i):
-            timestamp.append(timestamp[-1] + dt_seg)
-
-    split_dt = 0.02
-
-    split_x = []
-    split_y = []
-    split_theta = []
-
-    time = 0
-    i = 0
-
-    while (i < way_i[-1]):
-        if (time >= timestamp[i] and time <= timestamp[i+1]):
-            split_x.append(interpolate(timestamp[i], time, timestamp[i+1], x[i], x[i+1]))
-            split_y.append(interpolate(timestamp[i], time, timestamp[i+1], y[i], y[i+1]))
-            split_theta.append(interpolate(timestamp[i], time, timestamp[i+1], theta[i], theta[i+1]))
-            time += split_dt
-        else:
-            i+=1
-
-    return [split_x, split_y, split_theta]
+def estimate_time(d, v, a):
+    # time to cover d from rest to rest, with top speed v and acceleration a
+    if d >= v * v / a:
+        return d / v + v / a
+    return 2 * math.sqrt(d / a)
+
+def timestamps(dts, way_i):
+    # time at every control point, given the dt of each segment
+    steps = np.repeat(np.asarray(dts, dtype=float), np.diff(way_i))
+    return np.concatenate([[0], np.cumsum(steps)])
+
+def resample(dts, way_i, states, dt=0.02, angles=()):
+    # linearly resamples every column of states (one row per control point) onto an even dt, in one pass
+    # columns listed in angles are unwrapped first so they interpolate the short way round
+    states = np.array(states, dtype=float)
+    if states.ndim == 1:
+        states = states[:, None]
+    for c in angles:
+        states[:, c] = np.unwrap(states[:, c])
+
+    t = timestamps(dts, way_i)
+    n = int(math.floor(t[-1] / dt + 1e-9)) + 1
+    split_t = np.arange(n) * dt
+
+    i = np.clip(np.searchsorted(t, split_t, side='right') - 1, 0, len(t) - 2)
+    w = ((split_t - t[i]) / (t[i+1] - t[i]))[:, None]
+    return states[i] * (1 - w) + states[i+1] * w
+
+def split_even_dt(dts, way_i, x, y, theta, dt=0.02):
+    split = resample(dts, way_i, np.column_stack([x, y, theta]), dt)
+    return [split[:, 0].tolist(), split[:, 1].tolist(), split[:, 2].tolist()]
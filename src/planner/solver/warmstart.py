@@ -0,0 +1,67 @@
+import numpy as np
+from cache import digest
+
+
+# config keys that describe the robot, a solution for another robot is a poor seed
+ROBOT_KEYS = ['side_length', 'mass', 'moment_of_inertia', 'free_percent', 'efficiency_percent', 'FOC', 'motor']
+
+def robot(data):
+    return digest({k: data['config'].get(k) for k in ROBOT_KEYS})
+
+def node_flags(data):
+    # which per-node constraints a path has, these change the problem structure
+    return [[node['vx'] is not None and node['vy'] is not None,
+             node['theta'] is not None,
+             not not node.get('guess', False),
+             'theta_v' in node] for node in data['nodes']]
+
+def closest(cache, data):
+    # cached solution of the path with the nearest nodes, among paths of the same robot with as many nodes as this one
+    nodes = data['nodes']
+    config = robot(data)
+    best = None
+    for key in cache.keys():
+        entry = cache.read(key)
+        if entry is None or len(entry['nodes']) != len(nodes) or entry.get('config') != config:
+            continue
+        d = sum((a['x'] - b['x'])**2 + (a['y'] - b['y'])**2 for a, b in zip(entry['nodes'], nodes))
+        if best is None or d < best[0]:
+            best = (d, key, entry)
+    if best is None:
+        return None
+    cache.touch(best[1])
+    return best[2]
+
+def stretch(values, old_way_i, new_way_i):
+    # moves rows of a solution from one horizon onto another, segment by segment
+    values = np.asarray(values, dtype=float)
+    src = []
+    for k in range(1, len(new_way_i)):
+        a, b = new_way_i[k-1], new_way_i[k]
+        oa, ob = old_way_i[k-1], old_way_i[k]
+        src.append(oa + (np.arange(a, b) - a) / (b - a) * (ob - oa))
+    src.append([old_way_i[-1]])
+    src = np.concatenate(src)
+    rows = np.arange(len(values))
+    return np.column_stack([np.interp(src, rows, values[:, c]) for c in range(values.shape[1])])
+
+def seed(opti, X, U, dts, way_i, entry):
+    # sets the primal initial guess from a cached solution
+    old_way_i = entry['way_i']
+    opti.set_initial(X, stretch(entry['X'], old_way_i, way_i))
+    opti.set_initial(U, stretch(entry['U'], old_way_i, way_i))
+    for k in range(len(dts)):
+        # keep the time spent in each segment
+        opti.set_initial(dts[k], entry['dts'][k] * (old_way_i[k+1] - old_way_i[k]) / (way_i[k+1] - way_i[k]))
+
+def store(cache, key, data, solution):
+    # solution as returned by problem.optimize
+    cache.put(key, {
+        'nodes': data['nodes'],
+        'config': robot(data),
+        'way_i': solution['way_i'],
+        'obstacle_order': solution['obstacle_order'],
+        'X': np.asarray(solution['X']).tolist(),
+        'U': np.asarray(solution['U']).tolist(),
+        'dts': list(map(float, solution['dts'])),
+    })